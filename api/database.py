@@ -0,0 +1,324 @@
+import os
+import sys
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+current_path = os.path.dirname(os.path.abspath(__file__))
+parent_path = os.path.abspath(os.path.join(current_path, ".."))
+sys.path.append(parent_path)
+import duckdb
+from fastapi import HTTPException
+from src.logger import setup_logging
+
+logger = setup_logging()
+
+# seconds between repeated interrupts while a timed-out query unwinds
+INTERRUPT_RETRY_SECONDS = 0.1
+
+# the QueryScope of the request running on this thread, if any
+active_scope = threading.local()
+
+
+class QueryScope:
+    """Cursors opened for one API request, so a timeout can interrupt the query still running on them"""
+
+    def __init__(self):
+        self.cursors = []
+        self.lock = threading.Lock()
+
+    def add(self, cursor):
+        with self.lock:
+            self.cursors.append(cursor)
+
+    def interrupt(self):
+        with self.lock:
+            cursors = list(self.cursors)
+        for cursor in cursors:
+            try:
+                cursor.interrupt()
+            except duckdb.Error:
+                # the worker closed it in the meantime
+                pass
+
+    def close(self):
+        # only once the worker is done with them; closing is a no-op for cursors the request already closed
+        with self.lock:
+            cursors, self.cursors = self.cursors, []
+        for cursor in cursors:
+            cursor.close()
+
+    def call(self, func):
+        active_scope.current = self
+        try:
+            return func()
+        finally:
+            active_scope.current = None
+
+
+class LakeCursor:
+    """DuckDB cursor that hands its catalog attachment back to the manager when closed"""
+
+    def __init__(self, cursor, release):
+        self.cursor = cursor
+        self.release = release
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.cursor.close()
+        finally:
+            self.release()
+
+
+class DuckLakeConnectionManager:
+    """DuckLake attached read-only for at most attach_ttl seconds at a time; requests use their own cursors
+
+    Even a read-only attach locks the catalog file, so an attachment is retired after its TTL and closed once its
+    last cursor closes, leaving a window for db_sync and gold builds to write.
+    """
+
+    def __init__(self, catalog_path=None, data_path=None, catalog_name="my_ducklake", attach_ttl=None):
+        self.catalog_path = catalog_path or os.path.join(parent_path, "catalog.ducklake")
+        self.data_path = data_path or os.path.join(parent_path, "data")
+        self.catalog_name = catalog_name
+        self.attach_ttl = attach_ttl if attach_ttl is not None else float(os.getenv("DUCKLAKE_ATTACH_TTL", 5))
+        self.connection = None
+        self.attached_at = None
+        # open cursors per attachment, including retired attachments still finishing a query or a streamed body
+        self.leases = {}
+        self.attach_count = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        duckdb.install_extension("ducklake")
+        connection = duckdb.connect()
+        connection.execute(
+            f"ATTACH 'ducklake:{self.catalog_path}' AS {self.catalog_name} (DATA_PATH '{self.data_path}', READ_ONLY)"
+        )
+        connection.execute(f"USE {self.catalog_name}")
+        return connection
+
+    def attach(self, connection):
+        # caller holds self.lock; connection is already attached by connect()
+        self.connection = connection
+        self.attached_at = time.monotonic()
+        self.leases[connection] = 0
+        self.attach_count += 1
+        # retire the attachment once its TTL is up, even if no further request arrives to notice
+        timer = threading.Timer(self.attach_ttl, self.expire, args=[connection])
+        timer.daemon = True
+        timer.start()
+        logger.info(f"Attached DuckLake read-only with data path: {self.data_path}")
+        return connection
+
+    def expire(self, connection):
+        with self.lock:
+            if connection is self.connection:
+                self.retire()
+
+    def retire(self):
+        # caller holds self.lock; new cursors go to a fresh attachment, busy ones detach when their last cursor closes
+        connection, self.connection = self.connection, None
+        if connection is not None and self.leases[connection] == 0:
+            self.detach(connection)
+
+    def detach(self, connection):
+        del self.leases[connection]
+        connection.close()
+        logger.info("DuckLake catalog detached")
+
+    def release(self, connection):
+        with self.lock:
+            self.leases[connection] -= 1
+            if self.leases[connection] == 0 and connection is not self.connection:
+                self.detach(connection)
+
+    def lease(self):
+        # the current attachment with one more open cursor counted against it, attaching first if there is none
+        with self.lock:
+            if self.connection is not None:
+                self.leases[self.connection] += 1
+                return self.connection
+        # install and ATTACH run outside self.lock, so other requests' cursors and releases are not held up behind them
+        connection = self.connect()
+        with self.lock:
+            if self.connection is None:
+                self.attach(connection)
+                connection = None
+            current = self.connection
+            self.leases[current] += 1
+        if connection is not None:
+            # another request attached first; its attachment is used instead
+            connection.close()
+        return current
+
+    def open(self):
+        # attach once at startup so a missing or broken catalog fails fast; the TTL still applies
+        self.release(self.lease())
+
+    def close(self):
+        with self.lock:
+            self.retire()
+
+    def open_cursor(self):
+        # cursors share the current attachment but run independently, so requests do not serialize
+        connection = self.lease()
+        try:
+            cursor = connection.cursor()
+        except Exception:
+            self.release(connection)
+            raise
+        lake_cursor = LakeCursor(cursor, lambda: self.release(connection))
+        scope = getattr(active_scope, "current", None)
+        if scope is not None:
+            scope.add(lake_cursor)
+        try:
+            cursor.execute(f"USE {self.catalog_name}")
+        except Exception:
+            lake_cursor.close()
+            raise
+        return lake_cursor
+
+    @contextmanager
+    def cursor(self):
+        cursor = self.open_cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def state(self):
+        with self.lock:
+            return {
+                "attached": self.connection is not None,
+                "attached_seconds": round(time.monotonic() - self.attached_at, 1) if self.connection is not None else None,
+                "attach_ttl_seconds": self.attach_ttl,
+                "open_cursors": sum(self.leases.values()),
+                "retired_attachments_open": sum(1 for connection in self.leases if connection is not self.connection),
+                "attach_count": self.attach_count,
+            }
+
+    def table_snapshot_id(self, table_name):
+        # the last snapshot that created, inserted into or deleted from this table; commits to other tables
+        # (bronze syncs, other gold models) leave it unchanged
+        schema_name, _, name = table_name.rpartition(".")
+        metadata = f"__ducklake_metadata_{self.catalog_name}"
+        with self.cursor() as cursor:
+            return cursor.execute(f"""
+                WITH current_table AS (
+                    SELECT t.table_id, t.begin_snapshot
+                    FROM {metadata}.ducklake_table AS t
+                    JOIN {metadata}.ducklake_schema AS s USING (schema_id)
+                    WHERE lower(s.schema_name) = lower(?) AND lower(t.table_name) = lower(?)
+                      AND t.end_snapshot IS NULL AND s.end_snapshot IS NULL
+                ),
+                file_changes AS (
+                    SELECT table_id, begin_snapshot, end_snapshot FROM {metadata}.ducklake_data_file
+                    UNION ALL
+                    SELECT table_id, begin_snapshot, end_snapshot FROM {metadata}.ducklake_delete_file
+                )
+                SELECT greatest(
+                    max(current_table.begin_snapshot),
+                    max(greatest(file_changes.begin_snapshot, file_changes.end_snapshot))
+                )
+                FROM current_table
+                LEFT JOIN file_changes USING (table_id)
+            """, [schema_name or "main", name]).fetchone()[0]
+
+    def ping(self):
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("SELECT 1").fetchone()
+            return True
+        except Exception as e:
+            logger.error(f"DuckLake health check failed: {e}")
+            return False
+
+
+class QueryExecutor:
+    """Sized thread pool for DuckDB work with admission control; overload and timeouts surface as 503"""
+
+    def __init__(self, max_workers=None, max_queue=None, timeout=None):
+        self.max_workers = max_workers or int(os.getenv("API_QUERY_WORKERS", 4))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("API_QUERY_QUEUE", 8))
+        self.timeout = timeout or float(os.getenv("API_QUERY_TIMEOUT", 30))
+        self.executor = None
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="duckdb-query")
+
+    def admit(self):
+        # running plus waiting requests; anything beyond that is turned away instead of queuing forever
+        with self.lock:
+            if self.active >= self.max_workers + self.max_queue:
+                logger.warning(f"Rejecting query: {self.active} requests already running or queued")
+                raise HTTPException(status_code=503, detail="Server busy, retry later", headers={"Retry-After": "5"})
+            self.active += 1
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+    async def wait_or_interrupt(self, future, scope):
+        # asyncio's own timeout would only stop waiting; the worker thread keeps its query, cursor and admission slot
+        pending = asyncio.wrap_future(future)
+        try:
+            return await asyncio.wait_for(asyncio.shield(pending), self.timeout)
+        except asyncio.TimeoutError:
+            if not future.cancel():
+                # interrupt until the worker is free, in case its next statement had not started yet
+                while not pending.done():
+                    scope.interrupt()
+                    await asyncio.wait([pending], timeout=INTERRUPT_RETRY_SECONDS)
+                # the interrupted query's error is expected; retrieving it keeps asyncio from logging it
+                pending.exception()
+                scope.close()
+            logger.warning(f"Query exceeded {self.timeout}s")
+            raise HTTPException(status_code=503, detail="Query timed out, retry later", headers={"Retry-After": "5"})
+
+    async def run(self, func, *args, **kwargs):
+        # returns only once the worker thread is done, so the caller's admission slot covers the whole query
+        self.start()
+        scope = QueryScope()
+        future = self.executor.submit(scope.call, functools.partial(func, *args, **kwargs))
+        return await self.wait_or_interrupt(future, scope)
+
+    def iterate(self, chunks):
+        # called inside run(), so a body pull that times out can interrupt the cursors this request opened
+        return self.pull_chunks(chunks, getattr(active_scope, "current", None) or QueryScope())
+
+    async def pull_chunks(self, chunks, scope):
+        # pull a synchronous body iterator on the query pool and release the admission slot when it ends
+        done = object()
+        try:
+            while True:
+                chunk = await self.wait_or_interrupt(self.executor.submit(next, chunks, done), scope)
+                if chunk is done:
+                    break
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            self.release()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+ducklake = DuckLakeConnectionManager()
+query_executor = QueryExecutor()
@@ -3,82 +3,562 @@ import sys
 current_path = os.path.dirname(os.path.abspath(__file__))
 parent_path = os.path.abspath(os.path.join(current_path, ".."))
 sys.path.append(parent_path)
+sys.path.append(current_path)
+import io
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+import pyarrow as pa
+import pyarrow.parquet as pq
 from fastapi import HTTPException
-import duckdb
+from fastapi.responses import Response, StreamingResponse
 from src.logger import setup_logging
-import duckdb
+from database import ducklake
 
 logger = setup_logging()
 
+# key_column must be unique and stable. DuckLake row ids only follow insertion order, which stops matching the model's
+# ORDER BY once an incremental gold refresh appends changed groups, so default_order_by carries that sort explicitly.
+# score/title/fiscal_year columns are what the min_score, max_score, title_contains and fiscal_year filters apply to.
 DATASET_CONFIG = {
     0: {
-        "table_name": "GOLD.nyc_salary_matches"
+        "table_name": "GOLD.nyc_salary_matches",
+        "key_column": "rowid",
+        "score_column": "match_score",
+        "default_order_by": "-match_score",
+        "title_columns": ["posted_job_title", "matched_actual_payroll_title"],
+        "fiscal_year_column": "fiscal_year"
     },
     1: {
-        "table_name": "GOLD.nyc_matched_job_posting_duration_SOC"
+        "table_name": "GOLD.nyc_matched_job_posting_duration_SOC",
+        "key_column": "rowid",
+        "score_column": None,
+        "default_order_by": "-median_posting_duration",
+        "title_columns": ["title", "lightcast_matched_occupation"],
+        "fiscal_year_column": None
     },
     2: {
-        "table_name": "GOLD.nyc_salary_matches_unique_job_posting_title"
+        "table_name": "GOLD.nyc_salary_matches_unique_job_posting_title",
+        "key_column": "rowid",
+        "score_column": "match_score",
+        "default_order_by": "-match_score",
+        "title_columns": ["posted_job_title", "matched_actual_payroll_title"],
+        "fiscal_year_column": None
     },
     3: {
-        "table_name": "GOLD.nyc_matched_job_posting_duration_SOC_unique_title"
+        "table_name": "GOLD.nyc_matched_job_posting_duration_SOC_unique_title",
+        "key_column": "rowid",
+        "score_column": None,
+        "default_order_by": "-median_posting_duration",
+        "title_columns": ["title", "lightcast_matched_occupation"],
+        "fiscal_year_column": None
     }
 }
 
-def fetch_single_dataset(dataset_id, offset, limit):
-    try:
-        dataset_id = int(dataset_id)
-        offset = int(offset)
-        limit = int(limit)
-        logger.info(f"Fetching dataset {dataset_id} with offset={offset}, limit={limit}")
-        
-        # Validate dataset_id
-        if dataset_id not in DATASET_CONFIG:
-            raise ValueError(f"Invalid dataset_id: {dataset_id}")
-        
-        dataset = DATASET_CONFIG[dataset_id]
-        logger.info(f"Using dataset: {dataset['table_name']}")
-        
-        duckdb.install_extension("ducklake")
-        db_path = os.path.join(parent_path, "nyc_jobs_audit.db")
+MAX_PAGE_SIZE = 100000
+STREAM_BATCH_SIZE = 10000
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+REPORT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("REPORT_CACHE_MAX_ENTRY_BYTES", 32 * 1024 * 1024))
 
-        con = duckdb.connect(db_path)
-        logger.info(f"Connected to persistent DuckDB database: {db_path}")
 
-        data_path = os.path.join(parent_path, "data")
-        catalog_path = os.path.join(parent_path, "catalog.ducklake")
+class ReportCache:
+    """LRU of serialized report bodies under a byte budget; a table's entries are dropped when its snapshot changes"""
 
-        logger.info(f"Attaching DuckLake with data path: {data_path}")
-        con.execute(f"ATTACH 'ducklake:{catalog_path}' AS my_ducklake (DATA_PATH '{data_path}')")
-        con.execute("USE my_ducklake")
-        logger.info("DuckLake attached and activated successfully")
+    def __init__(self, max_bytes=REPORT_CACHE_MAX_BYTES, max_entry_bytes=REPORT_CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        # last snapshot seen per gold table
+        self.snapshot_ids = {}
+        self.lock = threading.Lock()
 
-        # Use a fully parameterized query
-        query = f"""
-            SELECT * FROM {dataset['table_name']}
-            OFFSET ?
-            LIMIT ?
-        """
-        logger.info(f"Executing parameterized query on table: {dataset['table_name']}")
-        result = con.execute(query, [offset, limit]).fetchall()
-        columns = [desc[0] for desc in con.description]
+    def check_snapshot(self, table_name, snapshot_id):
+        # caller holds the lock
+        previous = self.snapshot_ids.get(table_name)
+        if snapshot_id != previous:
+            stale_keys = [key for key, entry in self.entries.items() if entry[2] == table_name]
+            if stale_keys:
+                logger.info(f"{table_name} changed (snapshot {previous} -> {snapshot_id}); dropping {len(stale_keys)} cached report(s)")
+            for key in stale_keys:
+                self.size_bytes -= len(self.entries.pop(key)[0])
+            self.snapshot_ids[table_name] = snapshot_id
+
+    def get(self, key, table_name, snapshot_id):
+        with self.lock:
+            self.check_snapshot(table_name, snapshot_id)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[:2]
+
+    def put(self, key, table_name, snapshot_id, body, next_cursor):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self.lock:
+            self.check_snapshot(table_name, snapshot_id)
+            if key in self.entries:
+                self.size_bytes -= len(self.entries.pop(key)[0])
+            self.entries[key] = (body, next_cursor, table_name)
+            self.size_bytes += len(body)
+            while self.size_bytes > self.max_bytes:
+                _, (evicted_body, _, _) = self.entries.popitem(last=False)
+                self.size_bytes -= len(evicted_body)
+
+
+report_cache = ReportCache()
 
-        data = [dict(zip(columns, row)) for row in result]
 
-        logger.info(f"Retrieved {len(data)} records")
+class ChunkSink(io.RawIOBase):
+    """Write-only file object that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        # parquet footers record absolute offsets, so report the total written, not the buffered size
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
         return data
-        
+
+
+# format name -> media type; ?format= wins over the Accept header
+RESPONSE_FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def resolve_response_format(format_param, accept_header):
+    if format_param:
+        if format_param not in RESPONSE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of {sorted(RESPONSE_FORMATS)}")
+        return format_param
+    accepted_types = [part.split(";")[0].strip() for part in (accept_header or "").split(",")]
+    for accepted_type in accepted_types:
+        for format_name, media_type in RESPONSE_FORMATS.items():
+            if accepted_type == media_type:
+                return format_name
+    return "json"
+
+
+def encode_cursor(sort_value, sort_key):
+    payload = json.dumps([sort_value, sort_key], default=str).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, sort_key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("cursor is not a value returned as next_cursor")
+    return sort_value, sort_key
+
+
+def quote_identifier(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def build_report_filters(dataset, table_columns, min_score, max_score, title_contains, fiscal_year):
+    # every filter value is bound as a parameter; only validated column names are interpolated
+    predicates = []
+    params = []
+    if min_score is not None or max_score is not None:
+        if not dataset["score_column"]:
+            raise ValueError("min_score/max_score are not supported for this report")
+        score_column = quote_identifier(dataset["score_column"])
+        if min_score is not None:
+            predicates.append(f"{score_column} >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            predicates.append(f"{score_column} <= ?")
+            params.append(max_score)
+    if title_contains:
+        title_predicates = [f"contains(lower({quote_identifier(column)}), lower(?))" for column in dataset["title_columns"]]
+        predicates.append("(" + " OR ".join(title_predicates) + ")")
+        params.extend([title_contains] * len(title_predicates))
+    if fiscal_year is not None:
+        if not dataset["fiscal_year_column"] or dataset["fiscal_year_column"] not in table_columns:
+            raise ValueError("fiscal_year is not supported for this report")
+        predicates.append(f"{quote_identifier(dataset['fiscal_year_column'])} = ?")
+        params.append(fiscal_year)
+    return predicates, params
+
+
+def parse_order_by(order_by, table_columns):
+    # "column" sorts ascending, "-column" descending; the key column always breaks ties
+    if not order_by:
+        return None, "ASC"
+    descending = order_by.startswith("-")
+    column = order_by.lstrip("-")
+    if column not in table_columns:
+        raise ValueError(f"order_by must be one of {table_columns}, optionally prefixed with '-'")
+    return column, "DESC" if descending else "ASC"
+
+
+def build_seek_predicate(sort_column, direction, key_column, cursor):
+    # keyset condition for "rows after the cursor" under ORDER BY sort_column direction NULLS LAST, key_column
+    sort_value, sort_key = decode_cursor(cursor)
+    if sort_column is None:
+        return f"{key_column} > ?", [sort_key]
+    if sort_value is None:
+        return f"({sort_column} IS NULL AND {key_column} > ?)", [sort_key]
+    comparison = ">" if direction == "ASC" else "<"
+    return (
+        f"({sort_column} {comparison} ? OR {sort_column} IS NULL OR ({sort_column} = ? AND {key_column} > ?))",
+        [sort_value, sort_value, sort_key],
+    )
+
+
+def open_dataset_page(
+    dataset_id,
+    cursor,
+    page_size,
+    columns=None,
+    min_score=None,
+    max_score=None,
+    title_contains=None,
+    order_by=None,
+    fiscal_year=None,
+):
+    # keyset page with projection, filters and sort pushed into DuckDB, read as Arrow record batches
+    db_cursor = None
+    try:
+        dataset_id = int(dataset_id)
+        page_size = int(page_size)
+        if dataset_id not in DATASET_CONFIG:
+            raise ValueError(f"Invalid dataset_id: {dataset_id}")
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+
+        dataset = DATASET_CONFIG[dataset_id]
+        db_cursor = ducklake.open_cursor()
+        # one read-only transaction per page, so next_cursor and the streamed body see the same snapshot;
+        # closing the cursor ends it
+        db_cursor.execute("BEGIN TRANSACTION")
+        table_columns = [row[0] for row in db_cursor.execute(f"DESCRIBE {dataset['table_name']}").fetchall()]
+
+        selected_columns = table_columns
+        if columns:
+            selected_columns = [column.strip() for column in columns.split(",") if column.strip()]
+            unknown_columns = [column for column in selected_columns if column not in table_columns]
+            if unknown_columns:
+                raise ValueError(f"Unknown columns {unknown_columns}; available columns are {table_columns}")
+
+        predicates, params = build_report_filters(dataset, table_columns, min_score, max_score, title_contains, fiscal_year)
+        sort_column, direction = parse_order_by(order_by or dataset["default_order_by"], table_columns)
+        sort_sql = quote_identifier(sort_column) if sort_column else None
+        key_column = dataset["key_column"]
+        if cursor:
+            seek_predicate, seek_params = build_seek_predicate(sort_sql, direction, key_column, cursor)
+            predicates.append(seek_predicate)
+            params.extend(seek_params)
     except ValueError as ve:
+        if db_cursor is not None:
+            db_cursor.close()
         logger.error(f"ValueError: {ve}")
         raise HTTPException(status_code=400, detail=str(ve))
-    except KeyError as ke:
-        logger.error(f"KeyError: {ke}")
-        raise HTTPException(status_code=404, detail="Dataset not found")
     except Exception as e:
+        if db_cursor is not None:
+            db_cursor.close()
+        logger.error(f"Error preparing dataset {dataset_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    where_sql = f"WHERE {' AND '.join(predicates)}" if predicates else ""
+    order_sql = f"{sort_sql} {direction} NULLS LAST, {key_column}" if sort_sql else key_column
+    sort_value_sql = sort_sql or "NULL"
+    reverse_direction = "ASC" if direction == "DESC" else "DESC"
+    reverse_order_sql = f"sort_value {reverse_direction} NULLS FIRST, sort_key DESC" if sort_sql else "sort_key DESC"
+    logger.info(f"Fetching dataset {dataset_id}: {where_sql or 'no filters'}, order by {order_sql}, page_size={page_size}")
+    try:
+        # find the page's last row from the sort columns alone, so next_cursor is known before the body streams
+        last_row = db_cursor.execute(f"""
+            SELECT sort_value, sort_key, COUNT(*) OVER () AS row_count
+            FROM (
+                SELECT {sort_value_sql} AS sort_value, {key_column} AS sort_key
+                FROM {dataset['table_name']}
+                {where_sql}
+                ORDER BY {order_sql}
+                LIMIT ?
+            )
+            ORDER BY {reverse_order_sql}
+            LIMIT 1
+        """, params + [page_size]).fetchone()
+        next_cursor = None
+        if last_row is not None and last_row[2] == page_size:
+            next_cursor = encode_cursor(last_row[0], last_row[1])
+
+        projection = ", ".join(quote_identifier(column) for column in selected_columns)
+        reader = db_cursor.execute(f"""
+            SELECT {projection}
+            FROM {dataset['table_name']}
+            {where_sql}
+            ORDER BY {order_sql}
+            LIMIT ?
+        """, params + [page_size]).fetch_record_batch(STREAM_BATCH_SIZE)
+    except Exception as e:
+        db_cursor.close()
         logger.error(f"Error fetching dataset {dataset_id}: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+    return db_cursor, reader, next_cursor
+
+
+def stream_json_page(db_cursor, reader, next_cursor):
+    # encodes one record batch at a time, so memory per request is bounded by STREAM_BATCH_SIZE
+    row_count = 0
+    separator = ""
+    try:
+        yield '{"data":['
+        for batch in reader:
+            if batch.num_rows == 0:
+                continue
+            row_count += batch.num_rows
+            yield separator + ",".join(json.dumps(row, default=str) for row in batch.to_pylist())
+            separator = ","
+        yield f'],"next_cursor":{json.dumps(next_cursor)}}}'
+        logger.info(f"Streamed {row_count} records as json")
+    finally:
+        db_cursor.close()
+
+
+def stream_ndjson_page(db_cursor, reader):
+    row_count = 0
+    try:
+        for batch in reader:
+            row_count += batch.num_rows
+            yield "".join(json.dumps(row, default=str) + "\n" for row in batch.to_pylist())
+        logger.info(f"Streamed {row_count} records as ndjson")
+    finally:
+        db_cursor.close()
+
+
+def stream_arrow_page(db_cursor, reader):
+    # record batches go straight from DuckDB into the IPC stream without becoming Python rows
+    sink = ChunkSink()
+    row_count = 0
+    try:
+        with pa.ipc.new_stream(sink, reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+                row_count += batch.num_rows
+                yield sink.drain()
+        yield sink.drain()
+        logger.info(f"Streamed {row_count} records as arrow")
     finally:
-        con.close()
+        db_cursor.close()
+
+
+def stream_parquet_page(db_cursor, reader):
+    sink = ChunkSink()
+    row_count = 0
+    try:
+        with pq.ParquetWriter(sink, reader.schema, compression="zstd") as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+                row_count += batch.num_rows
+                yield sink.drain()
+        yield sink.drain()
+        logger.info(f"Streamed {row_count} records as parquet")
+    finally:
+        db_cursor.close()
+
+
+def stream_dataset_page(response_format, db_cursor, reader, next_cursor):
+    if response_format == "json":
+        return stream_json_page(db_cursor, reader, next_cursor)
+    if response_format == "ndjson":
+        return stream_ndjson_page(db_cursor, reader)
+    if response_format == "arrow":
+        return stream_arrow_page(db_cursor, reader)
+    return stream_parquet_page(db_cursor, reader)
+
+
+def cache_stream(chunks, cache_key, table_name, snapshot_id, next_cursor):
+    # pass chunks through to the client and keep a copy until the entry would exceed the cache's limit
+    collected = []
+    collected_bytes = 0
+    for chunk in chunks:
+        data = chunk.encode() if isinstance(chunk, str) else chunk
+        if collected is not None:
+            collected.append(data)
+            collected_bytes += len(data)
+            if collected_bytes > report_cache.max_entry_bytes:
+                collected = None
+        yield data
+    if collected is not None:
+        report_cache.put(cache_key, table_name, snapshot_id, b"".join(collected), next_cursor)
+
+
+def report_etag(snapshot_id, cache_key):
+    return '"' + hashlib.sha256(f"{snapshot_id}:{cache_key}".encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(etag, if_none_match):
+    return bool(if_none_match) and etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+def serve_report(report_id, response_format, if_none_match=None, cursor=None, page_size=10000, body_wrapper=None, **query):
+    # a gold table only changes with a snapshot that writes to it, so (its last snapshot, request) identifies the body
+    table_name = get_dataset(report_id)["table_name"]
+    snapshot_id = ducklake.table_snapshot_id(table_name)
+    cache_key = json.dumps(
+        [str(report_id), response_format, cursor, page_size, sorted(query.items())],
+        default=str,
+    )
+    etag = report_etag(snapshot_id, cache_key)
+    media_type = RESPONSE_FORMATS[response_format]
+
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    cached = report_cache.get(cache_key, table_name, snapshot_id)
+    if cached is not None:
+        body, next_cursor = cached
+        return Response(
+            content=body,
+            media_type=media_type,
+            headers={"ETag": etag, "X-Next-Cursor": next_cursor or "", "X-Cache": "hit"},
+        )
+
+    db_cursor, reader, next_cursor = open_dataset_page(report_id, cursor, page_size, **query)
+    body = cache_stream(stream_dataset_page(response_format, db_cursor, reader, next_cursor), cache_key, table_name, snapshot_id, next_cursor)
+    return StreamingResponse(
+        body_wrapper(body) if body_wrapper else body,
+        media_type=media_type,
+        headers={"ETag": etag, "X-Next-Cursor": next_cursor or "", "X-Cache": "miss"},
+    )
+
+
+MAX_HISTOGRAM_BINS = 200
+NUMERIC_TYPE_PREFIXES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT", "FLOAT", "DOUBLE", "DECIMAL")
+
+
+def get_dataset(dataset_id):
+    try:
+        dataset_id = int(dataset_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid dataset_id: {dataset_id}")
+    if dataset_id not in DATASET_CONFIG:
+        raise HTTPException(status_code=400, detail=f"Invalid dataset_id: {dataset_id}")
+    return DATASET_CONFIG[dataset_id]
+
+
+def numeric_columns(db_cursor, table_name):
+    return [
+        row[0]
+        for row in db_cursor.execute(f"DESCRIBE {table_name}").fetchall()
+        if row[1].upper().startswith(NUMERIC_TYPE_PREFIXES)
+    ]
+
+
+def summarize_dataset(dataset_id, min_score=None, max_score=None, title_contains=None, fiscal_year=None):
+    # row count plus min/max/mean of every numeric column, aggregated in DuckDB
+    dataset = get_dataset(dataset_id)
+    with ducklake.cursor() as db_cursor:
+        table_columns = [row[0] for row in db_cursor.execute(f"DESCRIBE {dataset['table_name']}").fetchall()]
+        try:
+            predicates, params = build_report_filters(dataset, table_columns, min_score, max_score, title_contains, fiscal_year)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+        columns = numeric_columns(db_cursor, dataset["table_name"])
+        where_sql = f"WHERE {' AND '.join(predicates)}" if predicates else ""
+
+        aggregates = ["COUNT(*)"]
+        for column in columns:
+            quoted = quote_identifier(column)
+            aggregates += [f"MIN({quoted})", f"MAX({quoted})", f"AVG({quoted})", f"COUNT({quoted})"]
+        row = db_cursor.execute(f"SELECT {', '.join(aggregates)} FROM {dataset['table_name']} {where_sql}", params).fetchone()
+
+    summary = {"report": dataset["table_name"].split("GOLD.")[-1], "row_count": row[0], "columns": {}}
+    for position, column in enumerate(columns):
+        column_min, column_max, column_mean, non_null = row[1 + position * 4: 5 + position * 4]
+        summary["columns"][column] = {"min": column_min, "max": column_max, "mean": column_mean, "non_null": non_null}
+    return summary
+
+
+def histogram_dataset(dataset_id, column, bins=20, min_score=None, max_score=None, title_contains=None, fiscal_year=None):
+    # equal-width bins between the filtered min and max, counted in DuckDB
+    dataset = get_dataset(dataset_id)
+    if not 0 < bins <= MAX_HISTOGRAM_BINS:
+        raise HTTPException(status_code=400, detail=f"bins must be between 1 and {MAX_HISTOGRAM_BINS}")
+    with ducklake.cursor() as db_cursor:
+        columns = numeric_columns(db_cursor, dataset["table_name"])
+        if column not in columns:
+            raise HTTPException(status_code=400, detail=f"column must be one of {columns}")
+        table_columns = [row[0] for row in db_cursor.execute(f"DESCRIBE {dataset['table_name']}").fetchall()]
+        try:
+            predicates, params = build_report_filters(dataset, table_columns, min_score, max_score, title_contains, fiscal_year)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+        quoted = quote_identifier(column)
+        where_sql = " AND ".join(predicates + [f"{quoted} IS NOT NULL"])
+
+        rows = db_cursor.execute(f"""
+            WITH filtered AS (
+                SELECT CAST({quoted} AS DOUBLE) AS value FROM {dataset['table_name']} WHERE {where_sql}
+            ),
+            bounds AS (
+                SELECT MIN(value) AS low, MAX(value) AS high FROM filtered
+            )
+            SELECT
+                LEAST(CAST(FLOOR((value - low) / NULLIF((high - low) / ?, 0)) AS INTEGER), ? - 1) AS bin,
+                COUNT(*) AS count,
+                ANY_VALUE(low) AS low,
+                ANY_VALUE(high) AS high
+            FROM filtered, bounds
+            GROUP BY bin
+            ORDER BY bin
+        """, params + [bins, bins]).fetchall()
+
+    if not rows:
+        return {"column": column, "bins": []}
+    low, high = rows[0][2], rows[0][3]
+    if low == high:
+        return {"column": column, "bins": [{"lower": low, "upper": high, "count": rows[0][1]}]}
+    width = (high - low) / bins
+    counts = {bin_index: count for bin_index, count, _, _ in rows}
+    return {
+        "column": column,
+        "bins": [
+            {"lower": low + bin_index * width, "upper": low + (bin_index + 1) * width, "count": counts.get(bin_index, 0)}
+            for bin_index in range(bins)
+        ],
+    }
+
+
+def serve_cached_json(kind, report_id, params, compute, if_none_match=None):
+    # aggregates are tiny, so they share the report cache and ETag scheme with the row-level pages
+    table_name = get_dataset(report_id)["table_name"]
+    snapshot_id = ducklake.table_snapshot_id(table_name)
+    cache_key = json.dumps([kind, str(report_id), sorted(params.items())], default=str)
+    etag = report_etag(snapshot_id, cache_key)
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    cached = report_cache.get(cache_key, table_name, snapshot_id)
+    if cached is not None:
+        return Response(content=cached[0], media_type="application/json", headers={"ETag": etag, "X-Cache": "hit"})
+
+    body = json.dumps(compute(report_id, **params), default=str).encode()
+    report_cache.put(cache_key, table_name, snapshot_id, body, None)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag, "X-Cache": "miss"})
 
 
 def get_reports_list():
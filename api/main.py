@@ -3,16 +3,30 @@ import sys
 current_path = os.path.dirname(os.path.abspath(__file__))
 parent_path = os.path.abspath(os.path.join(current_path, ".."))
 sys.path.append(parent_path)
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import JSONResponse, StreamingResponse
 from src.logger import setup_logging
-from fetch_data import get_reports_list, fetch_single_dataset
+from fetch_data import get_reports_list, serve_report, resolve_response_format, serve_cached_json, summarize_dataset, histogram_dataset
+from database import ducklake, query_executor
+from contextlib import asynccontextmanager
+import asyncio
 import datetime
 
-app = FastAPI()
 logger = setup_logging()
 
+@asynccontextmanager
+async def lifespan(app):
+    # attach up front so a broken catalog fails at startup; attachments then rotate on DUCKLAKE_ATTACH_TTL
+    ducklake.open()
+    query_executor.start()
+    yield
+    query_executor.shutdown()
+    ducklake.close()
+
+app = FastAPI(lifespan=lifespan)
+
 @app.get("/", tags=["Root"])
-def read_root():
+async def read_root():
     try:
         logger.info("Root endpoint accessed")
         return {"message": "Welcome to the NYC Jobs Audit API. Please visit '/docs' for documentation on how to use this API."}
@@ -21,17 +35,25 @@ def read_root():
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @app.get("/health", tags=["Health"])
-def read_health():
+async def read_health():
     try: 
         logger.info("Health endpoint accessed")
-        return {"status": "healthy",
-                "timestamp": datetime.datetime.now().isoformat()}
+        # runs outside the query pool so a backlog of report pulls cannot hold it up
+        database_ok = await asyncio.to_thread(ducklake.ping)
+        status = {"status": "healthy" if database_ok else "unhealthy",
+                  "database": "ok" if database_ok else "unavailable",
+                  # whether the catalog is attached right now, for how long, and how many cursors hold it
+                  "catalog": ducklake.state(),
+                  "timestamp": datetime.datetime.now().isoformat()}
+        if not database_ok:
+            return JSONResponse(status_code=503, content=status)
+        return status
     except Exception as e:
         logger.error(f"Error fetching health status: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @app.get("/reports", tags=["Reports"])
-def read_reports_list():
+async def read_reports_list():
     try:
         reports = get_reports_list()
         return reports
@@ -39,13 +61,77 @@ def read_reports_list():
         logger.error(f"Error fetching reports list: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@app.get("/reports/{report_id}/summary", tags=["Reports"])
+async def read_report_summary(
+    report_id,
+    min_score: float | None = None,
+    max_score: float | None = None,
+    title_contains: str | None = None,
+    fiscal_year: int | None = None,
+    if_none_match: str | None = Header(default=None),
+):
+    params = {"min_score": min_score, "max_score": max_score, "title_contains": title_contains, "fiscal_year": fiscal_year}
+    return await run_admitted(serve_cached_json, "summary", report_id, params, summarize_dataset, if_none_match)
+
+@app.get("/reports/{report_id}/histogram", tags=["Reports"])
+async def read_report_histogram(
+    report_id,
+    column: str,
+    bins: int = 20,
+    min_score: float | None = None,
+    max_score: float | None = None,
+    title_contains: str | None = None,
+    fiscal_year: int | None = None,
+    if_none_match: str | None = Header(default=None),
+):
+    params = {"column": column, "bins": bins, "min_score": min_score, "max_score": max_score, "title_contains": title_contains, "fiscal_year": fiscal_year}
+    return await run_admitted(serve_cached_json, "histogram", report_id, params, histogram_dataset, if_none_match)
+
+async def run_admitted(func, *args, **kwargs):
+    query_executor.admit()
+    try:
+        return await query_executor.run(func, *args, **kwargs)
+    finally:
+        query_executor.release()
+
 @app.get("/reports/{report_id}", tags=["Reports"])
-def read_report(report_id):
+async def read_report(
+    report_id,
+    cursor: str | None = None,
+    page_size: int = 10000,
+    format: str | None = None,
+    columns: str | None = None,
+    min_score: float | None = None,
+    max_score: float | None = None,
+    title_contains: str | None = None,
+    order_by: str | None = None,
+    fiscal_year: int | None = None,
+    accept: str | None = Header(default=None),
+    if_none_match: str | None = Header(default=None),
+):
+    # the query runs before streaming starts, so bad input still gets a proper status code
+    response_format = resolve_response_format(format, accept)
+    query_executor.admit()
     try:
-        report = fetch_single_dataset(report_id, 0, 750000)
-        if not report:
-            raise HTTPException(status_code=404, detail="Report not found")
-        return report
-    except Exception as e:
-        logger.error(f"Error fetching report {report_id}: {e}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
+        response = await query_executor.run(
+            serve_report,
+            report_id,
+            response_format,
+            if_none_match=if_none_match,
+            cursor=cursor,
+            page_size=page_size,
+            body_wrapper=query_executor.iterate,
+            columns=columns,
+            min_score=min_score,
+            max_score=max_score,
+            title_contains=title_contains,
+            order_by=order_by,
+            fiscal_year=fiscal_year,
+        )
+    except Exception:
+        query_executor.release()
+        raise
+    # a streamed body keeps its admission slot until query_executor.iterate finishes
+    if not isinstance(response, StreamingResponse):
+        query_executor.release()
+    return response
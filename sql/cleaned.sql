@@ -1,4 +1,6 @@
 -- Here will be the SQL code to create the cleaned tables that will be looped over in main.py
+-- Each statement is one gold model over a single BRONZE table with business_title aliased as its key;
+-- cleaned_data.py rebuilds only the business_title groups whose bronze rows changed.
 CREATE TABLE IF NOT EXISTS GOLD.nyc_salary_matches AS
 SELECT
     business_title AS posted_job_title,
@@ -7,10 +9,11 @@ SELECT
     salary_range_from AS posting_min_salary,
     salary_range_to AS posting_max_salary,
     base_salary AS actual_base_salary,
-    CAST(CAST(strptime(post_until, '%d-%b-%Y') AS DATE) - CAST(posting_date AS DATE) AS INTEGER) AS posting_duration_days,
+    posting_duration_days,
     regular_gross_paid AS actual_gross_paid,
     total_ot_paid AS actual_ot_paid,
-    total_other_pay AS actual_other_pay
+    total_other_pay AS actual_other_pay,
+    fiscal_year
 FROM BRONZE.payroll_to_jobs_title_fuzzy_matches
 ORDER BY match_score DESC;
 
@@ -33,7 +36,7 @@ SELECT
     MAX(salary_range_from) AS posting_min_salary,
     MAX(salary_range_to) AS posting_max_salary,
     MAX(base_salary) AS actual_base_salary,
-    MAX(CAST(CAST(strptime(post_until, '%d-%b-%Y') AS DATE) - CAST(posting_date AS DATE) AS INTEGER)) AS posting_duration_days,
+    MAX(posting_duration_days) AS posting_duration_days,
     MAX(regular_gross_paid) AS actual_gross_paid,
     MAX(total_ot_paid) AS actual_ot_paid,
     MAX(total_other_pay) AS actual_other_pay
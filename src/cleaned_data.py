@@ -1,8 +1,9 @@
 from prefect import flow
 from dotenv import load_dotenv
 from logger import setup_logging
-from prefect.client.schemas.schedules import CronSchedule
 import time
+import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
 import sys
 import duckdb
@@ -10,47 +11,274 @@ current_path = os.path.dirname(os.path.abspath(__file__))
 parent_path = os.path.abspath(os.path.join(current_path, ".."))
 sys.path.append(parent_path)
 from db_sync import db_sync
+from lake_layout import LAKE_LOCK
 load_dotenv()
 logger = setup_logging()
 
+MODEL_PATTERN = re.compile(r"CREATE TABLE IF NOT EXISTS\s+(GOLD\.\w+)\s+AS\s+(SELECT.*?);", re.IGNORECASE | re.DOTALL)
+SOURCE_PATTERN = re.compile(r"FROM\s+BRONZE\.(\w+)", re.IGNORECASE)
+KEY_PATTERN = re.compile(r"business_title\s+AS\s+(\w+)", re.IGNORECASE)
+ORDER_BY_PATTERN = re.compile(r"\s+ORDER BY\s+[^;]*$", re.IGNORECASE | re.DOTALL)
+TABLE_REFERENCE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+((?:BRONZE|SILVER|GOLD)\.\w+)", re.IGNORECASE)
+
+# share of a model's business_title groups that may change before a full rebuild is cheaper than delete + insert;
+# the matchers re-upload their whole output each run, which marks every group as changed
+GOLD_FULL_REFRESH_RATIO = float(os.getenv("GOLD_FULL_REFRESH_RATIO", 0.5))
+
+
+def parse_gold_models(script):
+    # each statement in cleaned.sql is one named gold model, normally over a single bronze table keyed by business_title
+    models = []
+    for table_name, select_sql in MODEL_PATTERN.findall(script):
+        source_match = SOURCE_PATTERN.search(select_sql)
+        key_match = KEY_PATTERN.search(select_sql)
+        models.append({
+            "table_name": table_name,
+            "select_sql": select_sql.strip(),
+            # models without a bronze source or business_title key are always rebuilt in full
+            "source_table": source_match.group(1) if source_match else None,
+            "key_column": key_match.group(1) if key_match else None,
+            "references": {name.lower() for name in TABLE_REFERENCE_PATTERN.findall(select_sql)},
+        })
+
+    # a model depends on every other model whose table it reads
+    model_names = {model["table_name"].lower(): model["table_name"] for model in models}
+    for model in models:
+        model["depends_on"] = {
+            model_names[name] for name in model["references"]
+            if name in model_names and name != model["table_name"].lower()
+        }
+    return models
+
+
+def incremental_select(model, affected_titles_sql):
+    # the model's SELECT restricted to the affected titles; row order no longer matters for an append
+    source_table = model["source_table"]
+    restricted_source = (
+        f"(SELECT * FROM BRONZE.{source_table} AS source "
+        f"WHERE EXISTS (SELECT 1 FROM ({affected_titles_sql}) AS affected "
+        f"WHERE affected.business_title IS NOT DISTINCT FROM source.business_title)) AS {source_table}"
+    )
+    select_sql = SOURCE_PATTERN.sub(f"FROM {restricted_source}", model["select_sql"], count=1)
+    return ORDER_BY_PATTERN.sub("", select_sql)
+
+
+def record_materialization(con, model, snapshot_id):
+    # append-only, so models refreshing concurrently never contend on deletes in the state table
+    con.execute(
+        "INSERT INTO GOLD._materializations VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+        [model["table_name"], model["source_table"], snapshot_id],
+    )
+
+
+def input_snapshot_id(con, catalog_name, model):
+    # the last snapshot that created, inserted into or deleted from any table the model reads;
+    # commits to unrelated tables (other bronze syncs, other gold models) leave it unchanged
+    metadata = f"__ducklake_metadata_{catalog_name}"
+    return con.execute(f"""
+        WITH input_tables AS (
+            SELECT t.table_id, t.begin_snapshot
+            FROM {metadata}.ducklake_table AS t
+            JOIN {metadata}.ducklake_schema AS s USING (schema_id)
+            WHERE list_contains(?, lower(s.schema_name || '.' || t.table_name))
+              AND t.end_snapshot IS NULL AND s.end_snapshot IS NULL
+        ),
+        file_changes AS (
+            SELECT table_id, begin_snapshot, end_snapshot FROM {metadata}.ducklake_data_file
+            UNION ALL
+            SELECT table_id, begin_snapshot, end_snapshot FROM {metadata}.ducklake_delete_file
+        )
+        SELECT greatest(
+            max(input_tables.begin_snapshot),
+            max(greatest(file_changes.begin_snapshot, file_changes.end_snapshot))
+        )
+        FROM input_tables
+        LEFT JOIN file_changes USING (table_id)
+    """, [sorted(model["references"])]).fetchone()[0]
+
+
+def materialize_gold_model(con, catalog_name, model):
+    table_name = model["table_name"]
+    snapshot_id = input_snapshot_id(con, catalog_name, model)
+    last_snapshot_id = con.execute(
+        "SELECT MAX(source_snapshot_id) FROM GOLD._materializations WHERE table_name = ?", [table_name]
+    ).fetchone()[0]
+    table_exists = con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE database_name = current_database() AND lower(schema_name) = 'gold' AND lower(table_name) = lower(?)",
+        [table_name.split(".", 1)[1]],
+    ).fetchone()[0]
+
+    if last_snapshot_id is not None and table_exists and snapshot_id is not None and last_snapshot_id >= snapshot_id:
+        # nothing is written, so the model's table keeps its snapshot and readers keep their caches
+        logger.info(f"{table_name} already reflects its inputs as of snapshot {snapshot_id}; skipping")
+        return
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        refreshed = False
+        if last_snapshot_id is not None and table_exists and model["source_table"] and model["key_column"]:
+            # titles touched by any bronze insert or delete since the last refresh
+            affected_titles_sql = (
+                f"SELECT DISTINCT business_title FROM ducklake_table_changes("
+                f"'{catalog_name}', 'BRONZE', '{model['source_table']}', {last_snapshot_id + 1}, {snapshot_id})"
+            )
+            try:
+                affected_count = con.execute(f"SELECT COUNT(*) FROM ({affected_titles_sql})").fetchone()[0]
+            except Exception as e:
+                # e.g. the bronze table was rebuilt since the last refresh; fall back to a full rebuild
+                logger.warning(f"No usable change feed for BRONZE.{model['source_table']} ({e}); rebuilding {table_name}")
+                con.execute("ROLLBACK")
+                con.execute("BEGIN TRANSACTION")
+            else:
+                key_column = model["key_column"]
+                group_count = con.execute(f"SELECT COUNT(DISTINCT {key_column}) FROM {table_name}").fetchone()[0]
+                if affected_count > GOLD_FULL_REFRESH_RATIO * group_count:
+                    # the rebuild also restores the model's ORDER BY, which appended groups do not follow
+                    logger.info(f"{affected_count} of {group_count} business_title group(s) changed in {table_name}; rebuilding it")
+                elif affected_count == 0:
+                    # e.g. only rows with unchanged titles were rewritten; skip without committing a snapshot
+                    logger.info(f"No business_title group changed in {table_name} since snapshot {last_snapshot_id}; skipping")
+                    con.execute("ROLLBACK")
+                    return
+                else:
+                    logger.info(f"Refreshing {affected_count} of {group_count} business_title group(s) in {table_name}")
+                    con.execute(f"""
+                    DELETE FROM {table_name} AS gold
+                    WHERE EXISTS (
+                        SELECT 1 FROM ({affected_titles_sql}) AS affected
+                        WHERE affected.business_title IS NOT DISTINCT FROM gold.{key_column}
+                    )
+                    """)
+                    con.execute(f"INSERT INTO {table_name} BY NAME {incremental_select(model, affected_titles_sql)}")
+                    refreshed = True
+
+        if not refreshed:
+            logger.info(f"Building {table_name}")
+            con.execute(f"CREATE OR REPLACE TABLE {table_name} AS {model['select_sql']}")
+
+        record_materialization(con, model, snapshot_id)
+        # the delete, insert and state update land as a single DuckLake snapshot
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+
+def select_gold_models(models, source_tables):
+    # models over the given bronze tables, plus every model downstream of them
+    selected = {model["table_name"] for model in models if model["source_table"] in source_tables}
+    while True:
+        downstream = {model["table_name"] for model in models if model["depends_on"] & selected} - selected
+        if not downstream:
+            return [model for model in models if model["table_name"] in selected]
+        selected |= downstream
+
+
+def run_gold_model(con, catalog_name, model):
+    # each model runs in its own cursor, so its transaction is independent of the others
+    model_start_time = time.time()
+    cursor = con.cursor()
+    try:
+        cursor.execute(f"USE {catalog_name}")
+        materialize_gold_model(cursor, catalog_name, model)
+        row_count = cursor.execute(f"SELECT COUNT(*) FROM {model['table_name']}").fetchone()[0]
+    finally:
+        cursor.close()
+    logger.info(f"{model['table_name']}: {row_count} rows in {time.time() - model_start_time:.2f} seconds")
+    return row_count
+
+
+def run_gold_models(con, catalog_name, models, max_workers=None):
+    # a model starts as soon as every model it reads from has finished; independent models run concurrently
+    pending = {model["table_name"]: model for model in models}
+    scheduled = set(pending)
+    completed, failed = set(), set()
+    max_workers = max_workers or min(len(models), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            for table_name, model in list(pending.items()):
+                if model["depends_on"] & failed:
+                    logger.error(f"Skipping {table_name}: upstream model(s) {', '.join(sorted(model['depends_on'] & failed))} failed")
+                    failed.add(table_name)
+                    del pending[table_name]
+                elif model["depends_on"] & scheduled <= completed:
+                    running[executor.submit(run_gold_model, con, catalog_name, model)] = table_name
+                    del pending[table_name]
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Circular dependency between gold models: {', '.join(sorted(pending))}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                table_name = running.pop(future)
+                try:
+                    future.result()
+                    completed.add(table_name)
+                except Exception as e:
+                    logger.error(f"Error building {table_name}: {e}")
+                    failed.add(table_name)
+
+    if failed:
+        raise RuntimeError(f"Gold model(s) failed: {', '.join(sorted(failed))}")
+
+
 @flow(name="business_logic_aggregation")
-def run_gold_layer():
+def run_gold_layer(max_workers=None):
     db_sync()
-    gold_start_time = time.time()
+    build_gold_layer(max_workers)
+
+
+def build_gold_layer(max_workers=None, source_tables=None):
+    # source_tables limits the build to models over those bronze tables, so a pipeline can refresh
+    # each gold model as soon as its own inputs land
+    with LAKE_LOCK:
+        gold_start_time = time.time()
+
+        duckdb.install_extension("ducklake")
+        db_path = os.path.join(parent_path, "nyc_jobs_audit.db")
 
-    duckdb.install_extension("ducklake")
-    db_path = os.path.join(parent_path, "nyc_jobs_audit.db")
+        con = duckdb.connect(db_path)
+        logger.info(f"Connected to persistent DuckDB database: {db_path}")
 
-    con = duckdb.connect(db_path)
-    logger.info(f"Connected to persistent DuckDB database: {db_path}")
+        data_path = os.path.join(parent_path, "data")
+        catalog_path = os.path.join(parent_path, "catalog.ducklake")
 
-    data_path = os.path.join(parent_path, "data")
-    catalog_path = os.path.join(parent_path, "catalog.ducklake")
+        logger.info(f"Attaching DuckLake with data path: {data_path}")
+        con.execute(f"ATTACH 'ducklake:{catalog_path}' AS my_ducklake (DATA_PATH '{data_path}')")
+        con.execute("USE my_ducklake")
+        logger.info("DuckLake attached and activated successfully")
 
-    logger.info(f"Attaching DuckLake with data path: {data_path}")
-    con.execute(f"ATTACH 'ducklake:{catalog_path}' AS my_ducklake (DATA_PATH '{data_path}')")
-    con.execute("USE my_ducklake")
-    logger.info("DuckLake attached and activated successfully")
+        logger.info("Running cleaned SQL script(s)")
 
-    logger.info("Running cleaned SQL script(s)")
+        with open("sql/cleaned.sql", "r") as f:
+            models = parse_gold_models(f.read())
+        if source_tables is not None:
+            models = select_gold_models(models, source_tables)
 
-    with open("sql/cleaned.sql", "r") as f:
-        query = f.read()
-    con.execute(query)
+        catalog_name = con.execute("SELECT current_database()").fetchone()[0]
+        con.execute("""
+        CREATE TABLE IF NOT EXISTS GOLD._materializations (
+            table_name VARCHAR,
+            source_table VARCHAR,
+            source_snapshot_id BIGINT,
+            refreshed_at TIMESTAMP WITH TIME ZONE
+        )
+        """)
+        run_gold_models(con, catalog_name, models, max_workers)
 
-    logger.info("Gold layer processing completed successfully")
+        logger.info("Gold layer processing completed successfully")
 
-    con.close()
-    gold_end_time = time.time()
+        con.close()
+        gold_end_time = time.time()
 
-    logger.info(f"Gold layer processing completed in {gold_end_time - gold_start_time:.2f} seconds")
+        logger.info(f"Gold layer processing completed in {gold_end_time - gold_start_time:.2f} seconds")
 
 if __name__ == "__main__":
+    # scheduled runs go through pipeline.py; this deployment is for ad hoc gold rebuilds
     run_gold_layer.serve(
         name="Business_Logic_Aggregation",
-        schedule=CronSchedule(
-            cron="0 2 * * 0",
-            timezone="UTC"
-        ), # sundays at 2 am
         tags=["business_logic", "weekly"]
     )
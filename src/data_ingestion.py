@@ -1,40 +1,251 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from minio import Minio
 import io
+import json
+from datetime import datetime, timezone
+import tempfile
+import shutil
+import threading
 import polars as pl
 import time
 from db_sync import db_sync
+from utils import upload_stream_to_minio, upload_parquet_and_remove_local, ParquetStreamWriter, get_minio_client, SOCRATA_ROW_ID
+from minio.error import S3Error
 from logger import setup_logging
 from prefect import flow, task
-from prefect.client.schemas.schedules import CronSchedule
+from prefect.futures import wait
 logger = setup_logging()
 load_dotenv()
 
-@task(name="Fetch API Data")
-def fetch_api_data(base_url):
-    limit = 50000
-    offset = 0
-    all_data = []
+current_path = os.path.dirname(os.path.abspath(__file__))
+parent_path = os.path.abspath(os.path.join(current_path, ".."))
+# last successful fetch per dataset, so weekly runs only request rows Socrata changed since then;
+# kept in the bucket next to the partitions it describes, so a fresh checkout never re-loads history on top of them
+WATERMARK_STATE_OBJECT = os.getenv("INGESTION_STATE_OBJECT", "_state/ingestion_state.json")
+WATERMARK_COLUMN = ":updated_at"
+# datasets ingest concurrently, so their read-modify-write of the shared state object is serialized
+WATERMARK_LOCK = threading.Lock()
+# Socrata system fields (:id, :updated_at, ...) ride along so bronze can keep only each row's latest version
+SYSTEM_FIELDS_SELECT = ":*, *"
+
+def load_watermarks(bucket=None, state_object=WATERMARK_STATE_OBJECT, client=None):
+    bucket = bucket or os.getenv("MINIO_BUCKET_NAME")
+    if not bucket:
+        return {}
+    client = client or get_minio_client()
+    try:
+        response = client.get_object(bucket, state_object)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return {}
+        raise
+    try:
+        return json.loads(response.read())
+    finally:
+        response.close()
+        response.release_conn()
+
+def save_watermark(dataset, watermark, bucket=None, state_object=WATERMARK_STATE_OBJECT, client=None):
+    bucket = bucket or os.getenv("MINIO_BUCKET_NAME")
+    client = client or get_minio_client()
+    with WATERMARK_LOCK:
+        watermarks = load_watermarks(bucket, state_object, client)
+        watermarks[dataset] = watermark
+        # a single put replaces the object atomically, so readers never see a truncated state
+        body = json.dumps(watermarks, indent=2).encode()
+        upload_stream_to_minio(io.BytesIO(body), len(body), bucket, state_object, client=client)
+
+def remove_superseded_objects(dataset, keep_object, bucket=None, client=None):
+    # after a successful full load: the legacy single object and every older partition are replaced by keep_object
+    bucket = bucket or os.getenv("MINIO_BUCKET_NAME")
+    client = client or get_minio_client()
+    stale_partitions = [
+        obj.object_name
+        for obj in client.list_objects(bucket, prefix=f"{dataset}/", recursive=True)
+        if obj.object_name != keep_object
+    ]
+    for object_name in [f"{dataset}.parquet"] + stale_partitions:
+        client.remove_object(bucket, object_name)
+    logger.info(f"Removed {len(stale_partitions)} older partition(s) of {dataset} and any legacy {dataset}.parquet")
+
+def watermark_value(updated_at):
+    # truncated to the second, so rows updated later in that same second are fetched again; bronze dedupes them by :id
+    return datetime.fromisoformat(updated_at.replace("Z", "+00:00")).strftime("%Y-%m-%dT%H:%M:%S")
+
+def build_where_clause(watermark):
+    if watermark is None:
+        return None
+    return f"{watermark['column']} > '{watermark['value']}'"
 
-    batch = [None]  # considered falsy for break at `[]`
+def build_http_session(pool_size, retries=5, backoff_factor=1.0):
+    # one pooled session for every page; transient Socrata errors are retried with exponential backoff
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_api_page(session, base_url, offset, limit, select=None, where=None, timeout=120):
+    # a stable $order keeps $offset pages disjoint when they are fetched concurrently
+    params = {"$limit": limit, "$offset": offset, "$order": ":id"}
+    if select:
+        params["$select"] = select if isinstance(select, str) else ",".join(select)
+    if where:
+        params["$where"] = where
+    response = session.get(base_url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+def iter_api_pages(base_url, limit=50000, max_workers=4, select=None, where=None, session=None):
+    # yields (offset, records) in offset order while up to max_workers pages are in flight
+    session = session or build_http_session(max_workers)
+    pending = {}
+    next_offset = 0
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while not exhausted and len(pending) < max_workers:
+                pending[next_offset] = executor.submit(fetch_api_page, session, base_url, next_offset, limit, select, where)
+                next_offset += limit
+            if not pending:
+                break
+
+            offset = min(pending)
+            batch = pending.pop(offset).result()
+            if len(batch) < limit:
+                # a short page is the last one; anything requested past it comes back empty
+                exhausted = True
+                for future in pending.values():
+                    future.cancel()
+                pending.clear()
+            if batch:
+                yield offset, batch
+
+@task(name="Fetch API Data")
+def fetch_api_data(base_url, select=None, limit=50000, max_workers=4):
+    page_frames = []
     total_records = 0
-    while batch:
-        paged_url = f"{base_url}?$limit={limit}&$offset={offset}"
-        response = requests.get(paged_url)
-        response.raise_for_status()
-        batch = response.json()
-        if not batch:
-            break
-        all_data.extend(batch)
+    for offset, batch in iter_api_pages(base_url, limit=limit, max_workers=max_workers, select=select):
+        page_frames.append(pl.DataFrame(batch))
         total_records += len(batch)
         logger.info(f"Fetched batch starting at record {offset}, total records fetched: {total_records}")
-        offset += limit
 
-    api_data_dataframe = pl.DataFrame(all_data)
+    if not page_frames:
+        return pl.DataFrame()
+    # Socrata omits null fields from records, so pages can disagree on columns
+    api_data_dataframe = pl.concat(page_frames, how="diagonal_relaxed")
     return api_data_dataframe
 
+def page_output_schema(page_paths):
+    # Socrata omits null fields, so the full column set and each column's type only emerge across every page
+    schema = pl.concat([pl.scan_parquet(path) for path in page_paths], how="diagonal_relaxed").collect_schema()
+    # columns that are null on every page have no usable type; Socrata sends text
+    return {
+        column: pl.Utf8 if dtype == pl.Null else dtype
+        for column, dtype in schema.items()
+    }
+
+def align_page_to_schema(page_frame, output_schema):
+    # a page is missing the columns that were null for all of its rows
+    return page_frame.select(
+        pl.col(column) if column in page_frame.columns else pl.lit(None, dtype=dtype).alias(column)
+        for column, dtype in output_schema.items()
+    )
+
+@task(name="Stream API Data to MinIO")
+def stream_api_data_to_minio(base_url, object_name, select=None, where=None, limit=50000, max_workers=4, spool_dir=None):
+    # each page is spooled to its own local file, then the pages become the row groups of one file
+    # that is multipart-uploaded, so memory is bounded by the page size rather than the full history
+    spool_dir = spool_dir or tempfile.gettempdir()
+    spool_path = os.path.join(spool_dir, os.path.basename(object_name))
+    page_dir = tempfile.mkdtemp(prefix="pages_", dir=spool_dir)
+    page_paths = []
+    writer = None
+    total_records = 0
+    latest_update = None
+    try:
+        for offset, batch in iter_api_pages(base_url, limit=limit, max_workers=max_workers, select=select, where=where):
+            page_path = os.path.join(page_dir, f"{offset:012d}.parquet")
+            page_frame = pl.DataFrame(batch, infer_schema_length=None)
+            page_frame.write_parquet(page_path)
+            page_paths.append(page_path)
+            if WATERMARK_COLUMN in page_frame.columns:
+                # ISO timestamps compare correctly as strings
+                page_latest = page_frame[WATERMARK_COLUMN].max()
+                if page_latest is not None and (latest_update is None or page_latest > latest_update):
+                    latest_update = page_latest
+            total_records += len(batch)
+            logger.info(f"Fetched batch starting at record {offset}, total records fetched: {total_records}")
+
+        if not page_paths:
+            logger.warning(f"No records returned for {object_name}; nothing uploaded.")
+            return 0, None
+
+        # the schema is fixed only once every page is in, so a column first seen on a later page is kept
+        writer = ParquetStreamWriter(spool_path, page_output_schema(page_paths), row_group_size=limit)
+        for page_path in page_paths:
+            writer.write(align_page_to_schema(pl.read_parquet(page_path), writer.output_schema))
+            os.remove(page_path)
+        writer.close()
+    except Exception:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        raise
+    finally:
+        shutil.rmtree(page_dir, ignore_errors=True)
+
+    logger.info(f"Spooled {writer.rows_written:,} rows to {spool_path} in {writer.row_groups_written} row groups.")
+    if not upload_parquet_and_remove_local(spool_path, logger, object_name):
+        return None
+    # the server-side :updated_at of the newest row fetched, when the rows carry it
+    return writer.rows_written, latest_update
+
+@task(name="Ingest API Delta to MinIO")
+def ingest_api_delta(base_url, dataset, select=None):
+    # only rows Socrata created or changed since the last successful run; each run lands as a new partition
+    watermark = load_watermarks().get(dataset)
+    fetch_started = datetime.now(timezone.utc)
+    object_name = f"{dataset}/{dataset}_{fetch_started:%Y%m%dT%H%M%S}.parquet"
+    if select is None:
+        select = SYSTEM_FIELDS_SELECT
+    else:
+        select = f"{SOCRATA_ROW_ID}, {WATERMARK_COLUMN}, " + (select if isinstance(select, str) else ",".join(select))
+
+    if watermark is None:
+        logger.info(f"No watermark for {dataset}; running a full load")
+    else:
+        logger.info(f"Fetching {dataset} rows with {watermark['column']} after {watermark['value']}")
+
+    result = stream_api_data_to_minio(base_url, object_name, select=select, where=build_where_clause(watermark))
+    if result is None:
+        logger.warning(f"{dataset} was not uploaded; watermark left unchanged")
+        return None
+    rows_written, latest_update = result
+
+    if watermark is None and rows_written:
+        # only once the full load is safely uploaded does it replace what was there before
+        remove_superseded_objects(dataset, object_name)
+
+    if latest_update is None:
+        logger.info(f"{dataset}: no rows changed; watermark left unchanged")
+    else:
+        # the watermark comes from the server's own clock, never the local one
+        save_watermark(dataset, {"column": WATERMARK_COLUMN, "value": watermark_value(latest_update)})
+    logger.info(f"{dataset}: {rows_written:,} new or changed rows ingested")
+    return rows_written
+
 @task(name="Convert CSV to Parquet")
 def convert_csv_to_parquet(dataframe):
     buffer = io.BytesIO()
@@ -49,58 +260,60 @@ def convert_csv_to_parquet(dataframe):
 
 @task(name="Write Data to MinIO")
 def write_data_to_minio(parquet_buffer, bucket_name, object_name):
-    minio_client = Minio(
-        os.getenv("MINIO_EXTERNAL_URL"),
-        access_key=os.getenv("MINIO_ACCESS_KEY"),
-        secret_key=os.getenv("MINIO_SECRET_KEY"),
-        secure=False
-    )
+    # stream straight from the in-memory buffer instead of copying its bytes first
+    length = parquet_buffer.seek(0, io.SEEK_END)
     parquet_buffer.seek(0)
-    data_bytes = parquet_buffer.read()
-    
+
     try:
-        minio_client.put_object(
-        bucket_name,
-        object_name,
-        io.BytesIO(data_bytes),
-        length=len(data_bytes),
-        content_type="application/x-parquet",
-    )
+        upload_stream_to_minio(parquet_buffer, length, bucket_name, object_name)
     except Exception as e:
         logger.error(f"Failed to write data to MinIO: {e}")
 
 
 @flow(name="Data_Ingestion_Flow")
-def run_data_ingestion():
+def run_data_ingestion(streaming=True, incremental=True):
     tick = time.time()
     payroll_url = os.getenv("NYC_PAYROLL_DATA_API")
     job_postings_url = os.getenv("NYC_JOB_POSTINGS_API")
     minio_bucket = os.getenv("MINIO_BUCKET_NAME")
-    nyc_payroll_filename = "nyc_payroll_data.parquet"
-    nyc_job_postings_filename = "nyc_job_postings_data.parquet"
-
-    nyc_payroll_dataframe = fetch_api_data(payroll_url)
-    payroll_parquet_buffer = convert_csv_to_parquet(nyc_payroll_dataframe)
-    logger.info("Writing NYC Payroll Data to MinIO Storage")
-    write_data_to_minio(payroll_parquet_buffer, minio_bucket, nyc_payroll_filename)
-
-    nyc_job_postings_dataframe = fetch_api_data(job_postings_url)
-    job_postings_parquet_buffer = convert_csv_to_parquet(nyc_job_postings_dataframe)
-    logger.info("Writing NYC Job Postings Data to MinIO Storage")
-    write_data_to_minio(job_postings_parquet_buffer, minio_bucket, nyc_job_postings_filename)
+    nyc_payroll_dataset = "nyc_payroll_data"
+    nyc_job_postings_dataset = "nyc_job_postings_data"
+    nyc_payroll_filename = f"{nyc_payroll_dataset}.parquet"
+    nyc_job_postings_filename = f"{nyc_job_postings_dataset}.parquet"
+
+    # the two datasets are independent, so both fetch and upload concurrently
+    if incremental:
+        logger.info("Ingesting new NYC Payroll and Job Postings Data to MinIO Storage")
+        wait([
+            ingest_api_delta.submit(payroll_url, nyc_payroll_dataset),
+            ingest_api_delta.submit(job_postings_url, nyc_job_postings_dataset),
+        ])
+    elif streaming:
+        logger.info("Streaming NYC Payroll and Job Postings Data to MinIO Storage")
+        wait([
+            stream_api_data_to_minio.submit(payroll_url, nyc_payroll_filename),
+            stream_api_data_to_minio.submit(job_postings_url, nyc_job_postings_filename),
+        ])
+    else:
+        nyc_payroll_dataframe = fetch_api_data(payroll_url)
+        payroll_parquet_buffer = convert_csv_to_parquet(nyc_payroll_dataframe)
+        logger.info("Writing NYC Payroll Data to MinIO Storage")
+        write_data_to_minio(payroll_parquet_buffer, minio_bucket, nyc_payroll_filename)
+
+        nyc_job_postings_dataframe = fetch_api_data(job_postings_url)
+        job_postings_parquet_buffer = convert_csv_to_parquet(nyc_job_postings_dataframe)
+        logger.info("Writing NYC Job Postings Data to MinIO Storage")
+        write_data_to_minio(job_postings_parquet_buffer, minio_bucket, nyc_job_postings_filename)
     tock = time.time() - tick
 
     logger.info("Synchronizing Data to Database")
-    db_sync()
+    db_sync(table_names=[nyc_payroll_dataset, nyc_job_postings_dataset])
 
     logger.info(f"Data ingestion completed in {tock:.2f} seconds.")
 
 if __name__ == "__main__":
+    # scheduled runs go through pipeline.py; this deployment is for ad hoc ingestion
     run_data_ingestion.serve(
         name="Data_Ingestion",
-        schedule=CronSchedule(
-            cron="0 0 * * 0",
-            timezone="UTC"
-        ), # sundays at midnight
         tags=["data_ingestion", "weekly"]
     )
\ No newline at end of file
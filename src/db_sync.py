@@ -2,9 +2,11 @@ from logger import setup_logging
 import os
 import sys
 import time
+import functools
 import duckdb
 from prefect import task
 from utils import update_data
+from lake_layout import LAKE_LOCK
 from dotenv import load_dotenv
 current_path = os.path.dirname(os.path.abspath(__file__))
 parent_path = os.path.abspath(os.path.join(current_path, ".."))
@@ -13,11 +15,9 @@ load_dotenv()
 
 logger = setup_logging()
 
-@task(name="database_synchronization")
-def db_sync():
-    total_start_time = time.time()
-    logger.info("Starting NYC Jobs Audit data pipeline")
-
+@functools.cache
+def load_duckdb_extensions():
+    # installing checks the extension repository, so do it once per process rather than on every sync
     logger.info("Installing and loading DuckDB extensions")
     duckdb.install_extension("ducklake")
     duckdb.install_extension("httpfs")
@@ -25,6 +25,18 @@ def db_sync():
     duckdb.load_extension("httpfs")
     logger.info("DuckDB extensions loaded successfully")
 
+@task(name="database_synchronization")
+def db_sync(max_workers=None, table_names=None):
+    # table_names limits the sync to the bronze tables a pipeline stage just produced; None syncs the whole bucket
+    with LAKE_LOCK:
+        sync_bronze_layer(max_workers, table_names)
+
+def sync_bronze_layer(max_workers=None, table_names=None):
+    total_start_time = time.time()
+    logger.info("Starting NYC Jobs Audit data pipeline")
+
+    load_duckdb_extensions()
+
     db_path = os.path.join(parent_path, "nyc_jobs_audit.db")
     con = duckdb.connect(db_path)
     logger.info(f"Connected to persistent DuckDB database: {db_path}")
@@ -38,11 +50,17 @@ def db_sync():
     logger.info("DuckLake attached and activated successfully")
 
     logger.info("Configuring MinIO S3 settings")
-    con.execute(f"SET s3_access_key_id = '{os.getenv('MINIO_ACCESS_KEY')}'")
-    con.execute(f"SET s3_secret_access_key = '{os.getenv('MINIO_SECRET_KEY')}'")
-    con.execute(f"SET s3_endpoint = '{os.getenv('MINIO_EXTERNAL_URL')}'")
-    con.execute("SET s3_use_ssl = false")
-    con.execute("SET s3_url_style = 'path'")
+    # a secret, unlike session SETs, is visible to every cursor the bronze loaders open
+    con.execute(f"""
+    CREATE OR REPLACE SECRET minio (
+        TYPE s3,
+        KEY_ID '{os.getenv('MINIO_ACCESS_KEY')}',
+        SECRET '{os.getenv('MINIO_SECRET_KEY')}',
+        ENDPOINT '{os.getenv('MINIO_EXTERNAL_URL')}',
+        USE_SSL false,
+        URL_STYLE 'path'
+    )
+    """)
     logger.info("MinIO S3 configuration completed")
 
     logger.info("Creating database schemas")
@@ -55,7 +73,7 @@ def db_sync():
     minio_bucket = os.getenv('MINIO_BUCKET_NAME')
 
     # creates initial database & also refreshes on new data ingestion
-    update_data(con, logger, minio_bucket)
+    update_data(con, logger, minio_bucket, max_workers=max_workers, table_names=table_names)
 
     bronze_end_time = time.time()
     logger.info(f"Bronze layer ingestion completed in {bronze_end_time - bronze_start_time:.2f} seconds")
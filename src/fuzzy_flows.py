@@ -1,23 +1,59 @@
 
-from prefect.client.schemas.schedules import CronSchedule
-from prefect import flow
+from prefect import flow, task
 from fuzzy_match_salary import fuzzy_match_payroll_to_jobs_vectorized
 from fuzzy_match_jobs_durations import fuzzy_match_jobs_to_lightcast_vectorized
 from db_sync import db_sync
+from utils import bronze_table_name
+import os
+
+SALARY_MATCH_OUTPUT = "data/BRONZE/payroll_to_jobs_title_fuzzy_matches.parquet"
+LIGHTCAST_MATCH_OUTPUT = "data/BRONZE/jobs_to_lightcast_title_fuzzy_matches.parquet"
+LIGHTCAST_SOURCE_PATH = "data/BRONZE/lightcast_top_posted_occupations_SOC/"
+# the Lightcast reference file is uploaded to the bucket by hand, so no ingest stage syncs its bronze table
+LIGHTCAST_SOURCE_TABLE = bronze_table_name(os.path.basename(os.path.normpath(LIGHTCAST_SOURCE_PATH)))[1]
+
+@task(name="match_payroll_to_jobs")
+def match_payroll_to_jobs():
+    fuzzy_match_payroll_to_jobs_vectorized(
+        payroll_path="data/BRONZE/nyc_payroll_data/",
+        jobs_path="data/BRONZE/nyc_job_postings_data/",
+        output_parquet=SALARY_MATCH_OUTPUT,
+        score_cutoff=85,
+        token_set_threshold=85,
+        limit=None,
+        payroll_chunk_size=100_000,
+        batch_size=100_000,
+        year_start=2024,
+        year_end=2025,
+        dedupe_titles=True,
+        batched_rescore=True
+    )
+    # the bronze table the uploaded output lands in, for the stage that syncs it
+    return bronze_table_name(os.path.basename(SALARY_MATCH_OUTPUT))[1]
+
+@task(name="match_jobs_to_lightcast")
+def match_jobs_to_lightcast():
+    fuzzy_match_jobs_to_lightcast_vectorized(
+        payroll_jobs_path="data/BRONZE/payroll_to_jobs_title_fuzzy_matches/",
+        lightcast_path=LIGHTCAST_SOURCE_PATH,
+        output_parquet=LIGHTCAST_MATCH_OUTPUT,
+        score_cutoff=75,
+        token_set_threshold=75,
+        payroll_chunk_size=100_000,
+        batch_size=100_000,
+        batched_rescore=True,
+    )
+    return bronze_table_name(os.path.basename(LIGHTCAST_MATCH_OUTPUT))[1]
 
 @flow(name="fuzzy_match")
 def fuzzy_match():
-    fuzzy_match_payroll_to_jobs_vectorized()
-    db_sync()
-    fuzzy_match_jobs_to_lightcast_vectorized()
-    db_sync()
+    # each matcher's output is synced on its own; the Lightcast matcher reads the salary matches and the Lightcast table
+    db_sync(table_names=[match_payroll_to_jobs(), LIGHTCAST_SOURCE_TABLE])
+    db_sync(table_names=[match_jobs_to_lightcast()])
 
 if __name__ == "__main__":
+    # scheduled runs go through pipeline.py; this deployment is for ad hoc re-matching
     fuzzy_match.serve(
         name="Fuzzy_Match",
-        schedule=CronSchedule(
-            cron="0 1 * * 0",
-            timezone="UTC"
-        ), # sundays at 1 am
         tags=["fuzzy_matching", "weekly"]
-    )
\ No newline at end of file
+    )
@@ -9,7 +9,8 @@ sys.path.append(parent_path)
 from logger import setup_logging
 from tqdm import tqdm
 from rapidfuzz import process, fuzz
-from utils import normalize_title, chunked, write_batch_to_parquet, merge_and_cleanup_batches, upload_parquet_and_remove_local, get_most_recent_file
+from lake_layout import read_lake_table
+from utils import BRONZE_METADATA_COLUMNS, normalize_title, chunked, ParquetStreamWriter, upload_parquet_and_remove_local, score_candidate_pairs, gather_matches
 import polars as pl
 import numpy as np
 
@@ -23,37 +24,24 @@ def fuzzy_match_jobs_to_lightcast_vectorized(
 	score_cutoff,
 	token_set_threshold,
 	payroll_chunk_size,
-	batch_size
+	batch_size,
+	batched_rescore=True
 ):
-	try:
-		payroll_file = get_most_recent_file(payroll_jobs_path)
-	except FileNotFoundError:
-		raise FileNotFoundError(f"No payroll parquet file found for: {payroll_jobs_path}")
-
-	try:
-		lightcast_file = get_most_recent_file(lightcast_path)
-	except FileNotFoundError:
-		raise FileNotFoundError(f"No lightcast parquet file found for: {lightcast_path}")
-
-	payroll_df = pl.read_parquet(payroll_file)
-	lightcast_df = pl.read_parquet(lightcast_file)
-
 	payroll_title_field = "business_title"
-	payroll_df = payroll_df.select(pl.col(payroll_title_field))
+	payroll_df = read_lake_table(payroll_jobs_path, [payroll_title_field])
 
 	lightcast_title_field = "Occupation (SOC)"
-	lightcast_df = lightcast_df.select(pl.col(lightcast_title_field))
-
-	payroll_data = payroll_df.to_dicts()
-	lightcast_data = lightcast_df.to_dicts()
-
-	payroll_titles_norm = [normalize_title(row.get(payroll_title_field, "")) for row in payroll_data]
-	lightcast_titles_norm = [normalize_title(row.get(lightcast_title_field, "")) for row in lightcast_data]
+	# only the Lightcast source columns; bronze's own metadata would collide with the columns the match table's load adds
+	lightcast_df = read_lake_table(lightcast_path).drop(BRONZE_METADATA_COLUMNS, strict=False)
+	lightcast_df = lightcast_df.select(
+		pl.col(lightcast_title_field).alias("lightcast_matched_occupation"),
+		pl.all()
+	)
 
-	lightcast_keep_cols = list(lightcast_df.columns)
+	payroll_titles_norm = [normalize_title(title) for title in payroll_df.get_column(payroll_title_field).to_list()]
+	lightcast_titles_norm = [normalize_title(title) for title in lightcast_df.get_column(lightcast_title_field).to_list()]
 
-	output_buffer = []
-	batch_count = 0
+	writer = ParquetStreamWriter(output_parquet, row_group_size=batch_size)
 
 	total_chunks = (len(payroll_titles_norm) + payroll_chunk_size - 1) // payroll_chunk_size
 	for start_index, end_index, payroll_chunk in tqdm(
@@ -76,38 +64,34 @@ def fuzzy_match_jobs_to_lightcast_vectorized(
 		if lightcast_indices.size == 0:
 			continue
 
-		matches_by_payroll_index = {}
-		for lightcast_index, payroll_local_index in zip(lightcast_indices, chunk_payroll_indices):
-			payroll_global_index = start_index + int(payroll_local_index)
-
-			match_score = fuzz.WRatio(lightcast_titles_norm[lightcast_index], payroll_titles_norm[payroll_global_index])
-			if match_score >= score_cutoff:
-				# Optionally enforce a per-job limit (top N lightcast matches)
-				matches_by_payroll_index.setdefault(payroll_global_index, []).append((lightcast_index, int(match_score)))
-
-		# Append all matches to the output buffer without limit
-		for payroll_global_index, match_list in matches_by_payroll_index.items():
-			payroll_row = payroll_data[payroll_global_index]
-			sorted_matches = sorted(match_list, key=lambda pair: pair[1], reverse=True)
-			for lightcast_index, score in sorted_matches:
-				lightcast_row = lightcast_data[lightcast_index]
-				out_row = {**payroll_row}
-				out_row["lightcast_matched_occupation"] = lightcast_row.get(lightcast_title_field)
-				out_row["lightcast_match_score"] = score
-				for col in lightcast_keep_cols:
-					out_row[col] = lightcast_row.get(col)
-				output_buffer.append(out_row)
-
-		if len(output_buffer) >= batch_size:
-			batch_count = write_batch_to_parquet(output_buffer, None, output_parquet, batch_count)
-
-	# flush last batch
-	if output_buffer:
-		batch_count = write_batch_to_parquet(output_buffer, None, output_parquet, batch_count)
-
-	logger.info(f"Intermediate matching complete. {batch_count} batch files written.")
-
-	merge_and_cleanup_batches(output_parquet, logger)
+		payroll_global_indices = chunk_payroll_indices + start_index
+		match_scores = score_candidate_pairs(
+			lightcast_titles_norm,
+			payroll_titles_norm,
+			lightcast_indices,
+			payroll_global_indices,
+			batched=batched_rescore
+		)
+		keep = match_scores >= score_cutoff
+
+		# Append all matches without limit, best lightcast match first for each payroll row
+		lightcast_indices = lightcast_indices[keep]
+		payroll_global_indices = payroll_global_indices[keep]
+		match_scores = match_scores[keep].astype(np.int64)
+		order = np.lexsort((-match_scores, payroll_global_indices))
+
+		writer.write(
+			gather_matches(
+				payroll_df, payroll_global_indices[order],
+				lightcast_df, lightcast_indices[order],
+				match_scores[order], "lightcast_match_score"
+			)
+		)
+
+	writer.close()
+
+	logger.info(f"Intermediate matching complete. {writer.rows_written:,} rows written to {output_parquet} in {writer.row_groups_written} row groups.")
+
 	upload_parquet_and_remove_local(output_parquet, logger)
 
 	logger.info(
@@ -115,8 +99,9 @@ def fuzzy_match_jobs_to_lightcast_vectorized(
 		f" - Compared {len(lightcast_titles_norm):,} Lightcast occupations against {len(payroll_titles_norm):,} payroll/job titles.\n"
 		f" - Score cutoff (WRatio): {score_cutoff}\n"
 		f" - Token set threshold: {token_set_threshold}\n"
+		f" - Batched WRatio rescoring: {batched_rescore}\n"
 		f" - Payroll chunk size: {payroll_chunk_size}\n"
-		f" - Written in batches of {batch_size} rows."
+		f" - Streamed to a single Parquet file in row groups of {batch_size} rows."
 	)
 
 
@@ -129,4 +114,5 @@ if __name__ == "__main__":
 		token_set_threshold=75,
 		payroll_chunk_size=100_000,
 		batch_size=100_000,
+		batched_rescore=True,
 	)
\ No newline at end of file
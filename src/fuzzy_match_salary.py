@@ -9,13 +9,16 @@ from logger import setup_logging
 from utils import (
     normalize_title,
     chunked,
-    write_batch_to_parquet,
-    merge_and_cleanup_batches,
     upload_parquet_and_remove_local,
-    get_most_recent_file,
-    posting_dates_handler,
-    apply_limit_to_matches
+    apply_limit_to_matches,
+    build_title_index,
+    ParquetStreamWriter,
+    score_candidate_pairs,
+    gather_matches,
+    build_salary_interval_index,
+    salary_ranges_overlap
 )
+from lake_layout import read_lake_table
 from tqdm import tqdm
 from rapidfuzz import process, fuzz
 import polars as pl
@@ -24,6 +27,161 @@ import numpy as np
 logger = setup_logging()
 
 
+def score_unique_title_pairs(
+    job_titles,
+    payroll_titles,
+    score_cutoff,
+    token_set_threshold,
+    payroll_chunk_size,
+    batched_rescore,
+    job_salary_ranges,
+    payroll_salary_ranges
+):
+    job_salaries_min, job_salaries_max = job_salary_ranges
+    payroll_salaries_min, payroll_salaries_max = payroll_salary_ranges
+
+    job_title_ids = []
+    payroll_title_ids = []
+    scores = []
+
+    total_chunks = (len(payroll_titles) + payroll_chunk_size - 1) // payroll_chunk_size
+    for start_index, end_index, payroll_titles_chunk in tqdm(
+        chunked(payroll_titles, payroll_chunk_size),
+        total=total_chunks,
+        desc="Matching unique titles (vectorized, chunked)"
+    ):
+        # ---- Token set pre-filter ----
+        similarity_matrix_token = process.cdist(
+            job_titles,
+            payroll_titles_chunk,
+            scorer=fuzz.token_set_ratio,
+            score_cutoff=token_set_threshold,
+            workers=-1,
+            dtype=np.uint8,
+        )
+
+        job_indices, chunk_payroll_indices = np.nonzero(similarity_matrix_token)
+
+        # ---- Salary pre-filter: a job title's posted range must overlap the payroll title's salaries ----
+        payroll_indices_global = chunk_payroll_indices + start_index
+        in_range = salary_ranges_overlap(
+            job_salaries_min[job_indices],
+            job_salaries_max[job_indices],
+            payroll_salaries_min[payroll_indices_global],
+            payroll_salaries_max[payroll_indices_global],
+        )
+        job_indices = job_indices[in_range]
+        chunk_payroll_indices = chunk_payroll_indices[in_range]
+        if job_indices.size == 0:
+            continue
+
+        # ---- Full WRatio on filtered candidates ----
+        wscores = score_candidate_pairs(
+            job_titles,
+            payroll_titles_chunk,
+            job_indices,
+            chunk_payroll_indices,
+            batched=batched_rescore
+        )
+        keep = wscores >= score_cutoff
+        job_title_ids.append(job_indices[keep])
+        payroll_title_ids.append(chunk_payroll_indices[keep] + start_index)
+        scores.append(wscores[keep].astype(np.uint8))
+
+    if not scores:
+        return pl.DataFrame(schema={"job_title_id": pl.UInt32, "payroll_title_id": pl.UInt32, "score": pl.UInt8})
+
+    return pl.DataFrame({
+        "job_title_id": np.concatenate(job_title_ids).astype(np.uint32),
+        "payroll_title_id": np.concatenate(payroll_title_ids).astype(np.uint32),
+        "score": np.concatenate(scores),
+    })
+
+
+def match_unique_titles(
+    jobs_df,
+    payroll_df,
+    writer,
+    score_cutoff,
+    token_set_threshold,
+    limit,
+    payroll_chunk_size,
+    batch_size,
+    batched_rescore
+):
+    jobs_df = jobs_df.with_row_index("job_row")
+    # payroll_row breaks score ties the same way match_all_rows does
+    payroll_df = payroll_df.with_row_index("payroll_row")
+    job_titles, jobs_indexed = build_title_index(jobs_df, "business_title", "job_title_id")
+    payroll_titles, payroll_indexed = build_title_index(payroll_df, "title_description", "payroll_title_id")
+    logger.info(f"Scoring {len(job_titles):,} unique job titles against {len(payroll_titles):,} unique payroll titles")
+
+    # ---- Salary envelope per unique title (widest posted range / lowest-highest payroll salary) ----
+    job_title_salaries = (
+        jobs_indexed.group_by("job_title_id")
+        .agg(pl.col("salary_range_from").min(), pl.col("salary_range_to").max())
+        .sort("job_title_id")
+    )
+    payroll_title_salaries = (
+        payroll_indexed.group_by("payroll_title_id")
+        .agg(pl.col("base_salary").min().alias("salary_min"), pl.col("base_salary").max().alias("salary_max"))
+        .sort("payroll_title_id")
+    )
+
+    title_matches = score_unique_title_pairs(
+        job_titles,
+        payroll_titles,
+        score_cutoff,
+        token_set_threshold,
+        payroll_chunk_size,
+        batched_rescore,
+        (
+            job_title_salaries.get_column("salary_range_from").to_numpy(),
+            job_title_salaries.get_column("salary_range_to").to_numpy(),
+        ),
+        (
+            payroll_title_salaries.get_column("salary_min").to_numpy(),
+            payroll_title_salaries.get_column("salary_max").to_numpy(),
+        )
+    )
+    logger.info(f"{title_matches.height:,} unique title pairs passed the WRatio cutoff")
+
+    # ---- Group job rows into batches sized by how many payroll rows their titles matched ----
+    payroll_title_counts = payroll_indexed.group_by("payroll_title_id").agg(pl.len().alias("candidate_rows"))
+    job_batches = (
+        jobs_indexed.select("job_row", "job_title_id")
+        .join(title_matches, on="job_title_id")
+        .join(payroll_title_counts, on="payroll_title_id")
+        .group_by("job_row")
+        .agg(pl.col("candidate_rows").sum())
+        .sort("job_row")
+        .with_columns((pl.col("candidate_rows").cum_sum() // batch_size).alias("batch_id"))
+    )
+
+    for batch_jobs in job_batches.partition_by("batch_id", maintain_order=True):
+        # ---- Join title scores back to row-level jobs and payroll ----
+        matches = (
+            jobs_indexed.join(batch_jobs.select("job_row"), on="job_row")
+            .join(title_matches, on="job_title_id")
+            .join(payroll_indexed, on="payroll_title_id")
+        )
+
+        # ---- Salary filter ----
+        matches = matches.filter(
+            pl.col("base_salary").is_between(pl.col("salary_range_from"), pl.col("salary_range_to"))
+        )
+
+        # ---- Apply limit if specified; every job row lives in exactly one batch, so this is its overall top `limit` ----
+        if limit is not None:
+            matches = (
+                matches.sort(["score", "payroll_row"], descending=[True, False])
+                .group_by("job_row", maintain_order=True)
+                .head(limit)
+            )
+
+        writer.write(matches)
+
+
 def fuzzy_match_payroll_to_jobs_vectorized(
     payroll_path,
     jobs_path,
@@ -34,7 +192,9 @@ def fuzzy_match_payroll_to_jobs_vectorized(
     payroll_chunk_size,
     batch_size,
     year_start,
-    year_end
+    year_end,
+    dedupe_titles=False,
+    batched_rescore=True
 ):
 
     payroll_columns = [
@@ -52,62 +212,116 @@ def fuzzy_match_payroll_to_jobs_vectorized(
         "salary_range_to",
         "posting_date",
         "post_until",
+        "posting_duration_days",
     ]
 
-    try: 
-        payroll_file = get_most_recent_file(payroll_path)
-    except FileNotFoundError:
-        raise FileNotFoundError(f"No payroll parquet file found for: {payroll_path}")
-    
-    try:
-        jobs_file = get_most_recent_file(jobs_path)
-    except FileNotFoundError:
-        raise FileNotFoundError(f"No jobs parquet file found for: {jobs_path}")
-
-    payroll_df = pl.read_parquet(payroll_file, columns=payroll_columns)
+    # only the requested fiscal years are read; other partitions and row groups are skipped
+    payroll_df = read_lake_table(payroll_path, payroll_columns, fiscal_years=range(int(year_start), int(year_end) + 1))
     payroll_df = payroll_df.with_columns(
         pl.col("fiscal_year").cast(pl.Int32).alias("fiscal_year")
     )
-    payroll_df = payroll_df.filter(pl.col("fiscal_year").is_between(int(year_start), int(year_end)))
-
-    jobs_df = pl.read_parquet(jobs_file, columns=jobs_columns)
-
-    # string → datetime → cleaned string (69-73)
-    jobs_df = jobs_df.with_columns(pl.col("posting_date").cast(pl.Utf8).str.strptime(pl.Datetime, "%Y-%m-%dT%H:%M:%S%.f", strict=False)).alias("posting_date_parsed")
-
-    jobs_df = jobs_df.filter(pl.col("posting_date_parsed").is_not_null())
+    payroll_df = payroll_df.with_columns(
+        pl.col(["base_salary", "regular_gross_paid", "total_ot_paid", "total_other_pay"]).cast(pl.Float64, strict=False)
+    )
 
+    jobs_df = read_lake_table(jobs_path, jobs_columns)
     jobs_df = jobs_df.with_columns(
-        pl.col("posting_date_parsed").dt.strftime("%Y-%m-%dT%H:%M:%S").alias("posting_date")
-    ).drop("posting_date_parsed")
-
-    payroll_data = payroll_df.to_dicts()
-    jobs_data = jobs_df.to_dicts()
-
-    # Fill null post_until with posting_date + 30 days
-    posting_dates_handler(jobs_data, "posting_date", "post_until", "%d-%b-%Y")
+        pl.col(["salary_range_from", "salary_range_to"]).cast(pl.Float64, strict=False)
+    )
 
-    payroll_titles_normalized = [normalize_title(row["title_description"]) for row in payroll_data]
-    job_titles_normalized = [normalize_title(row["business_title"]) for row in jobs_data]
+    # posting dates arrive typed from bronze, with the post_until fallback and the duration already applied
+    jobs_df = jobs_df.filter(pl.col("posting_date").is_not_null())
 
     # ---- Output schema ----
     output_schema = {
         "business_title": pl.Utf8,
         "salary_range_from": pl.Float64,
         "salary_range_to": pl.Float64,
-        "posting_date": pl.Utf8,
-        "post_until": pl.Utf8,
+        "posting_date": pl.Date,
+        "post_until": pl.Date,
+        "posting_duration_days": pl.Int32,
         "title_description": pl.Utf8,
         "base_salary": pl.Float64,
         "pay_basis": pl.Utf8,
         "regular_gross_paid": pl.Float64,
         "total_ot_paid": pl.Float64,
         "total_other_pay": pl.Float64,
+        "fiscal_year": pl.Int32,
         "score": pl.UInt8,
     }
 
-    output_buffer = []
-    batch_count = 0
+    with ParquetStreamWriter(output_parquet, output_schema, row_group_size=batch_size) as writer:
+        if dedupe_titles:
+            match_unique_titles(
+                jobs_df,
+                payroll_df,
+                writer,
+                score_cutoff,
+                token_set_threshold,
+                limit,
+                payroll_chunk_size,
+                batch_size,
+                batched_rescore
+            )
+        else:
+            match_all_rows(
+                jobs_df,
+                payroll_df,
+                writer,
+                score_cutoff,
+                token_set_threshold,
+                limit,
+                payroll_chunk_size,
+                batched_rescore
+            )
+
+    logger.info(f"Fuzzy matching complete. {writer.rows_written:,} rows written to {output_parquet} in {writer.row_groups_written} row groups.")
+
+    # upload final parquet to MinIO and delete local copy
+    upload_parquet_and_remove_local(output_parquet, logger)
+    logger.info(
+        "Notes:\n"
+        f" - Compared {jobs_df.height:,} job titles against {payroll_df.height:,} payroll titles.\n"
+        f" - Deduplicated titles before scoring: {dedupe_titles}\n"
+        f" - Batched WRatio rescoring: {batched_rescore}\n"
+        f" - Score cutoff (WRatio): {score_cutoff}\n"
+        f" - Token set threshold: {token_set_threshold}\n"
+        f" - Salary filter applied before scoring: only keep payroll salaries within job range\n"
+        f" - Limit per job: {limit}\n"
+        f" - Payroll chunk size: {payroll_chunk_size}\n"
+        f" - Streamed to a single Parquet file in row groups of {batch_size} rows.\n"
+        " - Non-matches or salary mismatches are skipped.\n"
+        " - Normalization applied: lowercase, no punctuation, single spaces."
+    )
+
+
+def match_all_rows(
+    jobs_df,
+    payroll_df,
+    writer,
+    score_cutoff,
+    token_set_threshold,
+    limit,
+    payroll_chunk_size,
+    batched_rescore
+):
+    job_titles_normalized = [normalize_title(title) for title in jobs_df.get_column("business_title").to_list()]
+
+    # ---- Salary interval index: payroll sorted by salary, each job owns a contiguous slice ----
+    # payroll_row keeps the input order, which breaks score ties the same way match_unique_titles does
+    payroll_df = payroll_df.with_row_index("payroll_row").sort("base_salary", nulls_last=True)
+    payroll_rows = payroll_df.get_column("payroll_row").to_numpy()
+    payroll_titles_normalized = [normalize_title(title) for title in payroll_df.get_column("title_description").to_list()]
+    job_payroll_lower, job_payroll_upper = build_salary_interval_index(
+        payroll_df.get_column("base_salary").to_numpy(),
+        jobs_df.get_column("salary_range_from").to_numpy(),
+        jobs_df.get_column("salary_range_to").to_numpy(),
+    )
+
+    # with a limit, each job's best matches so far are carried across chunks so the limit is per job, not per chunk
+    kept_job_indices = np.empty(0, dtype=np.int64)
+    kept_payroll_indices = np.empty(0, dtype=np.int64)
+    kept_scores = np.empty(0, dtype=np.float64)
 
     total_chunks = (len(payroll_titles_normalized) + payroll_chunk_size - 1) // payroll_chunk_size
     for start_index, end_index, payroll_titles_chunk in tqdm(
@@ -115,9 +329,14 @@ def fuzzy_match_payroll_to_jobs_vectorized(
         total=total_chunks,
         desc="Matching (vectorized, chunked)"
     ):
+        # ---- Only jobs whose salary slice overlaps this chunk ----
+        active_jobs = np.flatnonzero((job_payroll_lower < end_index) & (job_payroll_upper > start_index))
+        if active_jobs.size == 0:
+            continue
+
         # ---- Token set pre-filter ----
         similarity_matrix_token = process.cdist(
-            job_titles_normalized,
+            [job_titles_normalized[job_index] for job_index in active_jobs],
             payroll_titles_chunk,
             scorer=fuzz.token_set_ratio,
             score_cutoff=token_set_threshold,
@@ -125,68 +344,48 @@ def fuzzy_match_payroll_to_jobs_vectorized(
             dtype=np.uint8,
         )
 
-        job_indices, chunk_payroll_indices = np.nonzero(similarity_matrix_token)
+        active_job_positions, chunk_payroll_indices = np.nonzero(similarity_matrix_token)
+        job_indices = active_jobs[active_job_positions]
+        payroll_indices_global = chunk_payroll_indices + start_index
+
+        # ---- Salary filter (before WRatio) ----
+        in_range = (
+            (payroll_indices_global >= job_payroll_lower[job_indices])
+            & (payroll_indices_global < job_payroll_upper[job_indices])
+        )
+        job_indices = job_indices[in_range]
+        payroll_indices_global = payroll_indices_global[in_range]
         if job_indices.size == 0:
             continue
 
-        matches_by_job = {}
-        for job_index, payroll_index_local in zip(job_indices, chunk_payroll_indices):
-            payroll_index_global = start_index + int(payroll_index_local)
-            # ---- Full WRatio on filtered candidates ----
-            wscore = fuzz.WRatio(
-                job_titles_normalized[job_index],
-                payroll_titles_normalized[payroll_index_global]
-            )
-            if wscore >= score_cutoff:
-                job_row = jobs_data[job_index]
-                payroll_row = payroll_data[payroll_index_global]
-
-                # ---- Salary filter ----
-                payroll_salary = payroll_row["base_salary"]
-                job_salary_min = job_row["salary_range_from"]
-                job_salary_max = job_row["salary_range_to"]
-
-                if (
-                    payroll_salary is not None
-                    and job_salary_min is not None
-                    and job_salary_max is not None
-                    and job_salary_min <= payroll_salary <= job_salary_max
-                ):
-                    if limit is None:
-                        output_buffer.append({**job_row, **payroll_row, "score": wscore})
-                    else:
-                        matches_by_job.setdefault(job_index, []).append((payroll_index_global, wscore))
+        # ---- Full WRatio on filtered candidates ----
+        wscores = score_candidate_pairs(
+            job_titles_normalized,
+            payroll_titles_normalized,
+            job_indices,
+            payroll_indices_global,
+            batched=batched_rescore
+        )
+        keep = wscores >= score_cutoff
+        job_indices = job_indices[keep]
+        payroll_indices_global = payroll_indices_global[keep]
+        wscores = wscores[keep]
 
         # ---- Apply limit if specified ----
         if limit is not None:
-            apply_limit_to_matches(matches_by_job, jobs_data, payroll_data, limit, output_buffer)
-
-        # ---- Batch write to separate Parquet files ----
-        if len(output_buffer) >= batch_size:
-            batch_count = write_batch_to_parquet(output_buffer, output_schema, output_parquet, batch_count)
+            kept_job_indices = np.concatenate([kept_job_indices, job_indices])
+            kept_payroll_indices = np.concatenate([kept_payroll_indices, payroll_indices_global])
+            kept_scores = np.concatenate([kept_scores, wscores])
+            kept_job_indices, kept_payroll_indices, kept_scores = apply_limit_to_matches(
+                kept_job_indices, kept_payroll_indices, kept_scores, limit, payroll_rows[kept_payroll_indices]
+            )
+            continue
 
-    # Flush last batch
-    if output_buffer:
-        batch_count = write_batch_to_parquet(output_buffer, output_schema, output_parquet, batch_count)
+        writer.write(gather_matches(jobs_df, job_indices, payroll_df, payroll_indices_global, wscores, "score"))
 
-    logger.info(f"Fuzzy matching complete. {batch_count} batch files written.")
+    if limit is not None:
+        writer.write(gather_matches(jobs_df, kept_job_indices, payroll_df, kept_payroll_indices, kept_scores, "score"))
 
-    # ---- Merge all batch files into single Parquet ----
-    merge_and_cleanup_batches(output_parquet, logger)
-    # upload final parquet to MinIO and delete local copy
-    upload_parquet_and_remove_local(output_parquet, logger)
-    logger.info(
-        "Notes:\n"
-        f" - Compared {len(job_titles_normalized):,} job titles against {len(payroll_titles_normalized):,} payroll titles.\n"
-        f" - Score cutoff (WRatio): {score_cutoff}\n"
-        f" - Token set threshold: {token_set_threshold}\n"
-        f" - Salary filter applied: only keep payroll salaries within job range\n"
-        f" - Limit per job: {limit}\n"
-        f" - Payroll chunk size: {payroll_chunk_size}\n"
-        f" - Written in batches of {batch_size} rows.\n"
-        " - Non-matches or salary mismatches are skipped.\n"
-        " - Normalization applied: lowercase, no punctuation, single spaces."
-    )
 
 if __name__ == "__main__":
     fuzzy_match_payroll_to_jobs_vectorized(
@@ -199,7 +398,9 @@ if __name__ == "__main__":
         payroll_chunk_size=100_000,
         batch_size=100_000,
         year_start=2024,
-        year_end=2025
+        year_end=2025,
+        dedupe_titles=True,
+        batched_rescore=True
     )
 
 
@@ -211,8 +412,8 @@ if __name__ == "__main__":
 # Multi-core processing
 # Normalization
 # Optional per-job limit
-# Merging all batch files into a single final Parquet
-# Automatic deletion of temporary batch files
+# Streaming row groups into a single final Parquet (no batch files to merge)
 
 # Run time Total for No Limit 2.0 : 2:23:19 | Total Returned Results: 8,737,221
-# Run time Total for No Limit 2.1 : 12:47 | Total Returned Results: 562,898
\ No newline at end of file
+# Run time Total for No Limit 2.1 : 12:47 | Total Returned Results: 562,898
+# Deduplicated titles: cdist/WRatio sized by distinct titles, scores joined back to rows
\ No newline at end of file
@@ -0,0 +1,122 @@
+from logger import setup_logging
+from dotenv import load_dotenv
+import os
+import re
+import string
+import sys
+import threading
+import duckdb
+import polars as pl
+current_path = os.path.dirname(os.path.abspath(__file__))
+parent_path = os.path.abspath(os.path.join(current_path, ".."))
+sys.path.append(parent_path)
+
+load_dotenv()
+logger = setup_logging()
+
+# DuckLake sessions in one process (bronze sync, gold builds, matcher reads) attach the same catalog file,
+# so they take turns; work outside the lake (API fetches, fuzzy scoring) still overlaps freely
+LAKE_LOCK = threading.RLock()
+
+# rows per Parquet row group DuckLake writes for laid-out tables; smaller groups prune finer, larger ones scan faster
+LAKE_ROW_GROUP_SIZE = int(os.getenv("LAKE_ROW_GROUP_SIZE", 100_000))
+
+# physical layout per bronze table: partition columns become directories, rows are sorted by normalized title
+# so per-row-group min/max statistics (and DuckDB's bloom filters on dictionary-encoded titles) can skip most of a file
+BRONZE_LAYOUTS = {
+    "nyc_payroll_data": {"partition_by": ["fiscal_year"], "sort_by": "title_description"},
+    "nyc_job_postings_data": {"partition_by": [], "sort_by": "business_title"},
+    "payroll_to_jobs_title_fuzzy_matches": {"partition_by": ["fiscal_year"], "sort_by": "business_title"},
+    "jobs_to_lightcast_title_fuzzy_matches": {"partition_by": [], "sort_by": "business_title"},
+}
+
+PUNCTUATION_PATTERN = "[" + re.escape(string.punctuation).replace("'", "''") + "]"
+
+
+def normalized_title_sql(column):
+    # SQL twin of utils.normalize_title: lowercase, no punctuation, single spaces
+    return (
+        f"trim(regexp_replace(regexp_replace(lower(\"{column}\"), '{PUNCTUATION_PATTERN}', '', 'g'), '\\s+', ' ', 'g'))"
+    )
+
+
+def layout_order_by(table_name):
+    layout = BRONZE_LAYOUTS.get(table_name)
+    if layout is None:
+        return ""
+    return f"ORDER BY {normalized_title_sql(layout['sort_by'])}"
+
+
+def apply_table_layout(con, table_name):
+    # only affects files written from now on; existing files keep their layout until the table is rebuilt
+    layout = BRONZE_LAYOUTS.get(table_name)
+    if layout is None:
+        return
+    catalog_name = con.execute("SELECT current_database()").fetchone()[0]
+    if layout["partition_by"]:
+        con.execute(f"ALTER TABLE BRONZE.{table_name} SET PARTITIONED BY ({', '.join(layout['partition_by'])})")
+    con.execute(
+        f"CALL {catalog_name}.set_option('parquet_row_group_size', {LAKE_ROW_GROUP_SIZE}, schema => 'BRONZE', table_name => '{table_name}')"
+    )
+    logger.info(f"BRONZE.{table_name}: partitioned by {layout['partition_by'] or 'nothing'}, sorted by normalized {layout['sort_by']}")
+
+
+def connect_lake(catalog_name="my_ducklake"):
+    duckdb.install_extension("ducklake")
+    con = duckdb.connect()
+    data_path = os.path.join(parent_path, "data")
+    catalog_path = os.path.join(parent_path, "catalog.ducklake")
+    con.execute(f"ATTACH 'ducklake:{catalog_path}' AS {catalog_name} (DATA_PATH '{data_path}', READ_ONLY)")
+    con.execute(f"USE {catalog_name}")
+    return con
+
+
+def lake_table_for_path(path):
+    # data/<SCHEMA>/<table>/ is where DuckLake keeps a table's files
+    schema_path, table_name = os.path.split(os.path.normpath(path))
+    schema_name = os.path.basename(schema_path)
+    if os.path.isfile(path) or schema_name.upper() not in ("BRONZE", "SILVER", "GOLD"):
+        return None
+    return f"{schema_name.upper()}.{table_name}"
+
+
+def read_lake_table(path, columns=None, fiscal_years=None, title_column=None, titles=None):
+    """Read a lake table (or a single Parquet file) with partition, statistics and bloom filter pruning.
+
+    Filters are pushed into the scan, so files and row groups outside the requested fiscal years or titles are skipped.
+    """
+    filters = []
+    if fiscal_years is not None:
+        filters.append(pl.col("fiscal_year").cast(pl.Int32, strict=False).is_in(list(fiscal_years)))
+    if titles is not None:
+        filters.append(pl.col(title_column).is_in(list(titles)))
+
+    table_name = lake_table_for_path(path)
+    if table_name is None:
+        # a standalone file or directory: polars pushes the same filters down to hive partitions and row-group statistics
+        frame = pl.scan_parquet(path)
+        for predicate in filters:
+            frame = frame.filter(predicate)
+        if columns is not None:
+            frame = frame.select(columns)
+        return frame.collect()
+
+    select_list = ", ".join(f'"{column}"' for column in columns) if columns else "*"
+    conditions, parameters = [], []
+    if fiscal_years is not None:
+        # string literals bind to the column's own type (VARCHAR from the API, INTEGER from the matchers),
+        # so the column stays uncast and DuckLake can prune fiscal_year partitions and file statistics
+        conditions.append(f"fiscal_year IN ({', '.join(repr(str(int(year))) for year in fiscal_years)})")
+    if titles is not None:
+        titles = list(titles)
+        conditions.append(f'"{title_column}" IN ({", ".join("?" for _ in titles)})')
+        parameters.extend(titles)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with LAKE_LOCK:
+        con = connect_lake()
+        try:
+            logger.info(f"Reading {table_name} {where_clause}".rstrip())
+            return con.execute(f"SELECT {select_list} FROM {table_name} {where_clause}", parameters).pl()
+        finally:
+            con.close()
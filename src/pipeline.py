@@ -0,0 +1,62 @@
+from prefect import flow, task
+from prefect.futures import wait
+from prefect.task_runners import ThreadPoolTaskRunner
+from prefect.client.schemas.schedules import CronSchedule
+from dotenv import load_dotenv
+from logger import setup_logging
+from data_ingestion import ingest_api_delta
+from db_sync import db_sync
+from fuzzy_flows import match_payroll_to_jobs, match_jobs_to_lightcast, LIGHTCAST_SOURCE_TABLE
+from cleaned_data import build_gold_layer
+import os
+import time
+load_dotenv()
+logger = setup_logging()
+
+NYC_PAYROLL_DATASET = "nyc_payroll_data"
+NYC_JOB_POSTINGS_DATASET = "nyc_job_postings_data"
+
+@task(name="build_gold_models")
+def build_gold_models(source_tables):
+    build_gold_layer(source_tables=source_tables)
+
+@flow(name="NYC_Jobs_Audit_Pipeline", task_runner=ThreadPoolTaskRunner(max_workers=4))
+def run_pipeline():
+    # one DAG instead of cron-offset deployments: every stage starts as soon as its own inputs are ready.
+    # Stages that touch the lake take turns on LAKE_LOCK; fetching, uploading and fuzzy scoring overlap with them.
+    tick = time.time()
+
+    # both APIs are fetched at once, and each dataset's bronze table syncs as soon as its own upload lands
+    payroll_ingested = ingest_api_delta.submit(os.getenv("NYC_PAYROLL_DATA_API"), NYC_PAYROLL_DATASET)
+    job_postings_ingested = ingest_api_delta.submit(os.getenv("NYC_JOB_POSTINGS_API"), NYC_JOB_POSTINGS_DATASET)
+    payroll_synced = db_sync.submit(table_names=[NYC_PAYROLL_DATASET], wait_for=[payroll_ingested])
+    job_postings_synced = db_sync.submit(table_names=[NYC_JOB_POSTINGS_DATASET], wait_for=[job_postings_ingested])
+    # the Lightcast reference table has no ingest stage; syncing it picks up a re-uploaded file before matching
+    lightcast_synced = db_sync.submit(table_names=[LIGHTCAST_SOURCE_TABLE])
+
+    # each matcher returns the bronze table its output feeds, so only that table is synced afterwards
+    salary_matches = match_payroll_to_jobs.submit(wait_for=[payroll_synced, job_postings_synced])
+    salary_matches_synced = db_sync.submit(table_names=[salary_matches])
+
+    # salary gold models build while the Lightcast matcher scores against the freshly synced matches
+    salary_gold = build_gold_models.submit([salary_matches], wait_for=[salary_matches_synced])
+    lightcast_matches = match_jobs_to_lightcast.submit(wait_for=[salary_matches_synced, lightcast_synced])
+    lightcast_matches_synced = db_sync.submit(table_names=[lightcast_matches])
+    lightcast_gold = build_gold_models.submit([lightcast_matches], wait_for=[lightcast_matches_synced])
+
+    wait([salary_gold, lightcast_gold])
+    # surface the first failure instead of reporting a half-built run as complete
+    for future in (salary_gold, lightcast_gold):
+        future.result()
+
+    logger.info(f"Pipeline completed in {time.time() - tick:.2f} seconds")
+
+if __name__ == "__main__":
+    run_pipeline.serve(
+        name="NYC_Jobs_Audit_Pipeline",
+        schedule=CronSchedule(
+            cron="0 0 * * 0",
+            timezone="UTC"
+        ), # sundays at midnight
+        tags=["data_ingestion", "fuzzy_matching", "business_logic", "weekly"]
+    )
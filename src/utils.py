@@ -1,14 +1,16 @@
 from logger import setup_logging
 from dotenv import load_dotenv
 import os
-import io
 import string
-import glob
 import re
 from minio import Minio
 import sys
-from datetime import datetime, timedelta
+from rapidfuzz import process, fuzz
+import numpy as np
 import polars as pl
+import pyarrow.parquet as pq
+from lake_layout import apply_table_layout, layout_order_by
+from concurrent.futures import ThreadPoolExecutor, as_completed
 current_path = os.path.dirname(os.path.abspath(__file__))
 parent_path = os.path.abspath(os.path.join(current_path, ".."))
 sys.path.append(parent_path)
@@ -29,17 +31,64 @@ def normalize_title(title):
     return title.strip()
 
 
-def get_most_recent_file(path, extension="*.parquet"):
-    if os.path.isfile(path):
-        return path
-    matches = (
-        glob.glob(path)
-        or glob.glob(os.path.join(path, extension))
-        or glob.glob(os.path.join(path, "**", extension), recursive=True)
+def build_title_index(dataframe, title_column, id_column):
+    # normalize each distinct raw title once and give every distinct normalized title an id
+    raw_titles = dataframe.get_column(title_column).drop_nulls().unique().to_list()
+    normalized_titles = [normalize_title(title) for title in raw_titles]
+    unique_titles = sorted({title for title in normalized_titles if title})
+    title_ids = {title: title_id for title_id, title in enumerate(unique_titles)}
+
+    title_lookup = pl.DataFrame(
+        {
+            title_column: raw_titles,
+            id_column: [title_ids.get(title) for title in normalized_titles],
+        },
+        schema={title_column: dataframe.schema[title_column], id_column: pl.UInt32},
+    ).drop_nulls(id_column)
+
+    # rows whose title normalizes to nothing can never pass the scorers, so the inner join drops them
+    indexed_dataframe = dataframe.join(title_lookup, on=title_column, how="inner", maintain_order="left")
+    return unique_titles, indexed_dataframe
+
+
+def score_candidate_pairs(query_titles, choice_titles, query_indices, choice_indices, batched=True, scorer=fuzz.WRatio):
+    # second-stage rescoring of the (query, choice) pairs that survived the token_set prefilter
+    if batched:
+        return process.cpdist(
+            np.asarray(query_titles, dtype=object)[query_indices],
+            np.asarray(choice_titles, dtype=object)[choice_indices],
+            scorer=scorer,
+            workers=-1,
+            dtype=np.float32,
+        )
+
+    # legacy path: one scorer call per pair in a Python loop
+    return np.fromiter(
+        (
+            scorer(query_titles[query_index], choice_titles[choice_index])
+            for query_index, choice_index in zip(query_indices, choice_indices)
+        ),
+        dtype=np.float32,
+        count=len(query_indices),
     )
-    if not matches:
-        raise FileNotFoundError(f"No files found matching {path} (ext={extension})")
-    return max(matches, key=os.path.getctime)
+
+
+def build_salary_interval_index(sorted_salaries, salary_min, salary_max):
+    # sorted_salaries is ascending with nulls (NaN) last; each range maps to the slice [lower, upper)
+    valid_salaries = sorted_salaries[:np.count_nonzero(~np.isnan(sorted_salaries))]
+    lower = np.searchsorted(valid_salaries, salary_min, side="left")
+    upper = np.searchsorted(valid_salaries, salary_max, side="right")
+
+    # missing or inverted ranges get an empty slice
+    empty = np.isnan(salary_min) | np.isnan(salary_max) | (upper < lower)
+    upper[empty] = lower[empty]
+    return lower, upper
+
+
+def salary_ranges_overlap(first_min, first_max, second_min, second_max):
+    # NaN bounds never overlap
+    return (first_min <= second_max) & (second_min <= first_max)
+
 
 def chunked(iterable, size):
     total_length = len(iterable)
@@ -47,61 +96,133 @@ def chunked(iterable, size):
         end_index = min(start_index + size, total_length)
         yield start_index, end_index, iterable[start_index:end_index]
 
-def write_batch_to_parquet(output_buffer, output_schema, output_parquet, batch_count):
-    for row in output_buffer:
-        for date_col in ["posting_date", "post_until"]:
-            if row[date_col] is not None:
-                row[date_col] = str(row[date_col])
-    batch_filename = output_parquet.replace(".parquet", f"_batch_{batch_count:03}.parquet")
-    # allow output_schema to be optional; fall back to schema inference
-    try:
-        if output_schema is not None:
-            pl.DataFrame(output_buffer, schema=output_schema).write_parquet(batch_filename)
-        else:
-            pl.DataFrame(output_buffer).write_parquet(batch_filename)
-    except Exception:
-        # final fallback: let polars infer schema and write
-        pl.DataFrame(output_buffer).write_parquet(batch_filename)
-    output_buffer.clear()
-    return batch_count + 1
-
-def merge_and_cleanup_batches(output_parquet, logger):
-    batch_files_pattern = output_parquet.replace(".parquet", "_batch_*.parquet")
-    batch_files = sorted(glob.glob(batch_files_pattern))
-    if batch_files:
-        logger.info(f"Merging {len(batch_files)} batch files into final Parquet...")
-        merged_df = pl.concat([pl.read_parquet(f) for f in batch_files])
-        merged_df.write_parquet(output_parquet)
-        logger.info(f"Final Parquet written to {output_parquet}")
-        for f in batch_files:
-            os.remove(f)
-        logger.info("Temporary batch files deleted.")
-    else:
-        logger.warning("No batch files found to merge.")
-
-def upload_file_to_minio(file_path, bucket_name, object_name):
-    client = Minio(
+def gather_matches(left_df, left_indices, right_df, right_indices, scores, score_column):
+    # assemble output rows column-wise from the source frames instead of merging row dicts
+    return pl.concat(
+        [
+            left_df[left_indices],
+            right_df[right_indices],
+            pl.DataFrame({score_column: scores}),
+        ],
+        how="horizontal",
+    )
+
+class ParquetStreamWriter:
+    """Append polars frames to a single Parquet file, one row group at a time"""
+
+    def __init__(self, output_parquet, output_schema=None, row_group_size=100_000):
+        self.output_parquet = output_parquet
+        self.output_schema = output_schema
+        self.row_group_size = row_group_size
+        self.buffer = []
+        self.buffered_rows = 0
+        self.rows_written = 0
+        self.row_groups_written = 0
+        self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, frame):
+        if self.output_schema is not None:
+            frame = frame.select(list(self.output_schema)).cast(self.output_schema)
+        if frame.height == 0:
+            return
+        self.buffer.append(frame)
+        self.buffered_rows += frame.height
+        # never hold more than one row group's worth of rows
+        while self.buffered_rows >= self.row_group_size:
+            self.flush(self.row_group_size)
+
+    def flush(self, rows=None):
+        buffered = pl.concat(self.buffer, rechunk=False)
+        rows = buffered.height if rows is None else rows
+        self.write_table(buffered.head(rows).to_arrow())
+
+        remainder = buffered.slice(rows)
+        self.buffer = [remainder] if remainder.height else []
+        self.buffered_rows = remainder.height
+
+    def write_table(self, table):
+        if self.writer is None:
+            # page indexes add per-page min/max on top of row-group statistics for finer pruning on read
+            self.writer = pq.ParquetWriter(self.output_parquet, table.schema, compression="zstd", write_page_index=True)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.rows_written += table.num_rows
+        self.row_groups_written += 1
+
+    def close(self):
+        if self.buffered_rows:
+            self.flush()
+        if self.writer is None and self.output_schema is not None:
+            # no matches: still leave an empty file with the expected columns
+            self.write_table(pl.DataFrame(schema=self.output_schema).to_arrow())
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        return self.rows_written
+
+# multipart settings for MinIO uploads; each in-flight part holds at most one part_size buffer
+MINIO_PART_SIZE = int(os.getenv("MINIO_PART_SIZE", 16 * 1024 * 1024))
+MINIO_PARALLEL_UPLOADS = int(os.getenv("MINIO_PARALLEL_UPLOADS", 4))
+
+def get_minio_client():
+    return Minio(
         os.getenv("MINIO_EXTERNAL_URL"),
         access_key=os.getenv("MINIO_ACCESS_KEY"),
         secret_key=os.getenv("MINIO_SECRET_KEY"),
         secure=False,
     )
-    with open(file_path, "rb") as fh:
-        data = fh.read()
-    client.put_object(
+
+def upload_stream_to_minio(
+    stream,
+    length,
+    bucket_name,
+    object_name,
+    client=None,
+    part_size=MINIO_PART_SIZE,
+    num_parallel_uploads=MINIO_PARALLEL_UPLOADS,
+):
+    # put_object reads the stream part by part, so the payload is never copied whole
+    client = client or get_minio_client()
+    return client.put_object(
         bucket_name,
         object_name,
-        io.BytesIO(data),
-        length=len(data),
+        stream,
+        length=length,
         content_type="application/x-parquet",
+        part_size=part_size,
+        num_parallel_uploads=num_parallel_uploads,
     )
 
-def upload_parquet_and_remove_local(parquet_path, logger):
+def upload_file_to_minio(
+    file_path,
+    bucket_name,
+    object_name,
+    client=None,
+    part_size=MINIO_PART_SIZE,
+    num_parallel_uploads=MINIO_PARALLEL_UPLOADS,
+):
+    with open(file_path, "rb") as fh:
+        return upload_stream_to_minio(
+            fh,
+            os.fstat(fh.fileno()).st_size,
+            bucket_name,
+            object_name,
+            client=client,
+            part_size=part_size,
+            num_parallel_uploads=num_parallel_uploads,
+        )
+
+def upload_parquet_and_remove_local(parquet_path, logger, object_name=None):
     bucket = os.getenv("MINIO_BUCKET_NAME")
     if not bucket:
         logger.warning("MINIO_BUCKET_NAME not set; skipping upload to MinIO")
         return False
-    object_name = os.path.basename(parquet_path)
+    object_name = object_name or os.path.basename(parquet_path)
     try:
         upload_file_to_minio(parquet_path, bucket, object_name)
         logger.info(f"Uploaded {parquet_path} to MinIO://{bucket}/{object_name}")
@@ -115,78 +236,294 @@ def upload_parquet_and_remove_local(parquet_path, logger):
         logger.error(f"Failed to upload {parquet_path} to MinIO: {exc}")
         raise
 
-def posting_dates_handler(jobs, posting_key, until_key, date_fmt):
-    null_value_fallback = 30
+def apply_limit_to_matches(group_indices, other_indices, match_scores, limit, tie_breaker=None):
+    # keep the top `limit` scores for every group index (e.g. per job); equal scores keep the lowest tie_breaker,
+    # or the earliest position when none is given
+    sort_keys = (-match_scores, group_indices) if tie_breaker is None else (tie_breaker, -match_scores, group_indices)
+    order = np.lexsort(sort_keys)
+    group_indices = group_indices[order]
+    other_indices = other_indices[order]
+    match_scores = match_scores[order]
 
-    for row_dict in jobs:
-        if row_dict.get(until_key):
-            continue
+    _, group_starts, group_inverse = np.unique(group_indices, return_index=True, return_inverse=True)
+    rank_in_group = np.arange(group_indices.size) - group_starts[group_inverse]
+    keep = rank_in_group < limit
+    return group_indices[keep], other_indices[keep], match_scores[keep]
 
-        posting_value = row_dict.get(posting_key)
-        if not posting_value:
-            continue
+def bronze_table_name(object_name):
+    # partitioned objects (<dataset>/<dataset>_<stamp>.parquet) map to one table per dataset prefix
+    file_name = object_name.split("/", 1)[0].replace('.parquet', '')
+    return file_name, file_name.lower().replace('-', '_').replace(' ', '_')
 
-        try:
-            posting_datetime = datetime.strptime(posting_value, "%Y-%m-%dT%H:%M:%S")
-        except Exception:
-            # minimal handling: skip non-matching strings
-            continue
-
-        row_dict[until_key] = (posting_datetime + timedelta(days=null_value_fallback)).strftime(date_fmt).upper()
-
-    result = jobs
-    return result
-
-
-def apply_limit_to_matches(matches_by_job, jobs_data, payroll_data, limit, output_buffer):
-    for job_index, match_list in matches_by_job.items():
-        # lambda is an anonymous function that takes 1 tuple (x) and returns the second element (x[1])
-        match_list = sorted(match_list, key=lambda x: x[1], reverse=True)[:limit]
-        job_row = jobs_data[job_index]
-        for payroll_index_global, match_score in match_list:
-            payroll_row = payroll_data[payroll_index_global]
-            payroll_salary = payroll_row["base_salary"]
-            job_salary_min = job_row["salary_range_from"]
-            job_salary_max = job_row["salary_range_to"]
-            if (
-                payroll_salary is not None
-                and job_salary_min is not None
-                and job_salary_max is not None
-                and job_salary_min <= payroll_salary <= job_salary_max
-            ):
-                output_buffer.append({**job_row, **payroll_row, "score": match_score})
-                
-def update_data(con, logger, bucket_name):
-    logger.info("Starting Bronze layer ingestion")
-    file_list_query = f"SELECT * FROM glob('s3://{bucket_name}/*.parquet')"
+def list_bucket_objects(bucket_name, client=None):
+    client = client or get_minio_client()
+    return {
+        obj.object_name: obj
+        for obj in client.list_objects(bucket_name, recursive=True)
+        if obj.object_name.endswith(".parquet")
+    }
 
-    try:
-        files_result = con.execute(file_list_query).fetchall()
-        file_paths = []
-        for row in files_result:
-            file_paths.append(row[0])
-        
-        logger.info(f"Found {len(file_paths)} files in MinIO bucket")
-        
-        for file_path in file_paths:
-            file_name = os.path.basename(file_path).replace('.parquet', '')
-            table_name = file_name.lower().replace('-', '_').replace(' ', '_')
-
-            logger.info(f"Processing file: {file_path} -> table: BRONZE.{table_name}")
-
-            BRONZE_query = f"""
-            CREATE TABLE IF NOT EXISTS BRONZE.{table_name} AS
+def bronze_object_path(bucket_name, object_name):
+    # where DuckDB reads a bucket object from; the httpfs secret for MinIO is set up by the caller
+    return f"s3://{bucket_name}/{object_name}"
+
+# columns bronze_select adds to every bronze table; anything re-published from bronze must drop them
+BRONZE_METADATA_COLUMNS = ["_source_file", "_source_object", "_ingestion_timestamp", "_record_id"]
+
+# Socrata's row identifier; it stays the same when a row is updated, so later partitions supersede earlier versions
+SOCRATA_ROW_ID = ":id"
+
+# days a job posting is assumed to stay up when post_until is missing or unparseable
+POSTING_FALLBACK_DAYS = 30
+
+def posting_dates_sql(source_columns, posting_key="posting_date", until_key="post_until", until_fmt="%d-%b-%Y", fallback_days=POSTING_FALLBACK_DAYS):
+    # Socrata's date strings typed once at load time, so readers get DATE columns and the duration instead of parsing;
+    # a missing or unparseable post_until falls back to posting_date + fallback_days
+    posting_date = "CAST(NULL AS DATE)"
+    if posting_key in source_columns:
+        posting_date = f'TRY_CAST(TRY_CAST("{posting_key}" AS TIMESTAMP) AS DATE)'
+    until_date = "CAST(NULL AS DATE)"
+    if until_key in source_columns:
+        until_date = f"""CAST(try_strptime(CAST("{until_key}" AS VARCHAR), '{until_fmt}') AS DATE)"""
+    post_until = f"coalesce({until_date}, {posting_date} + {fallback_days})"
+    return {
+        posting_key: posting_date,
+        until_key: post_until,
+        "posting_duration_days": f"CAST(date_diff('day', {posting_date}, {post_until}) AS INTEGER)",
+    }
+
+# typed columns per bronze table, derived from the columns its files carry
+BRONZE_TYPED_COLUMNS = {
+    "nyc_job_postings_data": posting_dates_sql,
+}
+
+def bronze_typed_columns(table_name, source_columns):
+    derive = BRONZE_TYPED_COLUMNS.get(table_name)
+    return derive(source_columns) if derive else {}
+
+def bronze_select(file_name, object_paths, record_id_offset, order_by="", row_key=None, typed_columns=None):
+    file_list = ", ".join(f"'{object_path}'" for object_path in object_paths)
+    source_columns = "* EXCLUDE (filename)"
+    if typed_columns:
+        # raw columns are replaced by their typed versions, which are added even when the files lack the raw column
+        excluded = ", ".join(f"'{column}'" for column in ["filename", *typed_columns])
+        source_columns = f"COLUMNS(lambda c: c NOT IN ({excluded})),\n                " + ",\n                ".join(
+            f'{expression} AS "{column}"' for column, expression in typed_columns.items()
+        )
+    latest_version = ""
+    if row_key:
+        # partitions are named by fetch time, so the last file holding a row has its latest version;
+        # rows from files without the key (older full loads) are kept as they are
+        latest_version = f'QUALIFY "{row_key}" IS NULL OR ROW_NUMBER() OVER (PARTITION BY "{row_key}" ORDER BY filename DESC) = 1'
+    return f"""
             SELECT 
-                *,
+                {source_columns},
                 '{file_name}' AS _source_file,
+                filename AS _source_object,
                 CURRENT_TIMESTAMP AS _ingestion_timestamp,
-                ROW_NUMBER() OVER () AS _record_id
-            FROM read_parquet('{file_path}');
+                {record_id_offset} + ROW_NUMBER() OVER () AS _record_id
+            FROM read_parquet([{file_list}], union_by_name = true, filename = true)
+            {latest_version}
+            {order_by}
             """
-            
-            con.execute(BRONZE_query)
-            logger.info(f"Successfully created or updated BRONZE.{table_name}")
+
+def file_columns(con, object_paths):
+    file_list = ", ".join(f"'{object_path}'" for object_path in object_paths)
+    return [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM read_parquet([{file_list}], union_by_name = true)").fetchall()]
+
+def add_missing_columns(con, table_name, load_select):
+    # later partitions may carry columns the table has not seen yet
+    incoming_columns = con.execute(f"DESCRIBE {load_select}").fetchall()
+    existing_columns = {row[0] for row in con.execute(f"DESCRIBE BRONZE.{table_name}").fetchall()}
+    for column_name, column_type, *_ in incoming_columns:
+        if column_name not in existing_columns:
+            con.execute(f'ALTER TABLE BRONZE.{table_name} ADD COLUMN "{column_name}" {column_type}')
+
+def changed_column_types(con, table_name, build_select):
+    # columns a rebuild would type differently from the table, e.g. strings now written as DATE;
+    # typed columns are compared as loaded, not as the raw strings in the files
+    incoming_columns = con.execute(f"DESCRIBE {build_select}").fetchall()
+    existing_types = {row[0]: row[1] for row in con.execute(f"DESCRIBE BRONZE.{table_name}").fetchall()}
+    return [
+        column_name for column_name, column_type, *_ in incoming_columns
+        if column_name in existing_types and existing_types[column_name] != column_type
+    ]
+
+def record_manifest_entries(con, table_name, objects):
+    for obj in objects:
+        con.execute(
+            "INSERT INTO BRONZE._load_manifest VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            [obj.object_name, table_name, obj.etag, obj.size, obj.last_modified],
+        )
+
+def apply_manifest_changes(con, table_name, reset_table, forget_objects, record_objects):
+    # manifest writes stay on one connection so concurrent table loads never contend on it
+    con.execute("BEGIN TRANSACTION")
+    try:
+        if reset_table:
+            con.execute("DELETE FROM BRONZE._load_manifest WHERE table_name = ?", [table_name])
+        elif forget_objects:
+            con.execute(
+                f"DELETE FROM BRONZE._load_manifest WHERE object_name IN ({', '.join('?' for _ in forget_objects)})",
+                forget_objects,
+            )
+        record_manifest_entries(con, table_name, record_objects)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+def refresh_bronze_table(con, logger, bucket_name, table_name, file_name, current_objects, loaded_etags, table_exists):
+    # returns the manifest changes for the caller to apply, or None when nothing changed
+    new_objects = [name for name in current_objects if name not in loaded_etags]
+    changed_objects = [name for name in current_objects if name in loaded_etags and loaded_etags[name] != current_objects[name].etag]
+    removed_objects = [name for name in loaded_etags if name not in current_objects]
+
+    if not (new_objects or changed_objects or removed_objects):
+        logger.info(f"BRONZE.{table_name} is up to date; skipping")
+        return None
+
+    def object_path(name):
+        return bronze_object_path(bucket_name, name)
+
+    objects_to_load = sorted(new_objects + changed_objects)
+    retyped_columns = []
+    if table_exists and loaded_etags and objects_to_load:
+        # compared against every current file, so partitions whose types merely widen do not force a rebuild
+        current_paths = [object_path(name) for name in sorted(current_objects)]
+        typed_columns = bronze_typed_columns(table_name, file_columns(con, current_paths))
+        retyped_columns = changed_column_types(con, table_name, bronze_select(file_name, current_paths, 0, typed_columns=typed_columns))
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        if not current_objects:
+            # every object behind the table is gone from the bucket
+            logger.info(f"No files left for BRONZE.{table_name}; dropping it")
+            con.execute(f"DROP TABLE IF EXISTS BRONZE.{table_name}")
+            manifest_changes = (True, [], [])
+        elif not table_exists or not loaded_etags or retyped_columns:
+            # new table, one built before the manifest existed, or one whose column types changed: load every current object once
+            if retyped_columns:
+                logger.info(f"Column type(s) changed for {retyped_columns} in BRONZE.{table_name}; rebuilding it")
+            logger.info(f"Building BRONZE.{table_name} from {len(current_objects)} file(s)")
+            build_paths = [object_path(name) for name in sorted(current_objects)]
+            source_columns = file_columns(con, build_paths)
+            row_key = SOCRATA_ROW_ID if SOCRATA_ROW_ID in source_columns else None
+            typed_columns = bronze_typed_columns(table_name, source_columns)
+            build_select = bronze_select(file_name, build_paths, 0, layout_order_by(table_name), row_key, typed_columns)
+            # create the table empty first so its partitioning and row-group size apply to the initial files
+            con.execute(f"CREATE OR REPLACE TABLE BRONZE.{table_name} AS SELECT * FROM ({build_select}) LIMIT 0")
+            apply_table_layout(con, table_name)
+            con.execute(f"INSERT INTO BRONZE.{table_name} {build_select}")
+            manifest_changes = (True, [], list(current_objects.values()))
+        else:
+            # new objects are cleared too, so a load whose manifest write never landed is not duplicated
+            stale_objects = objects_to_load + removed_objects
+            logger.info(f"Removing rows from {len(changed_objects) + len(removed_objects)} changed or deleted file(s) in BRONZE.{table_name}")
+            con.execute(
+                f"DELETE FROM BRONZE.{table_name} WHERE _source_object IN ({', '.join('?' for _ in stale_objects)})",
+                [object_path(name) for name in stale_objects],
+            )
+
+            if objects_to_load:
+                logger.info(f"Appending {len(objects_to_load)} new or changed file(s) to BRONZE.{table_name}")
+                load_paths = [object_path(name) for name in objects_to_load]
+                source_columns = file_columns(con, load_paths)
+                typed_columns = bronze_typed_columns(table_name, source_columns)
+                add_missing_columns(con, table_name, bronze_select(file_name, load_paths, 0, typed_columns=typed_columns))
+                apply_table_layout(con, table_name)
+                row_key = SOCRATA_ROW_ID if SOCRATA_ROW_ID in source_columns else None
+                if row_key:
+                    # delta partitions carry the changed versions of rows loaded earlier; drop the superseded ones
+                    file_list = ", ".join(f"'{load_path}'" for load_path in load_paths)
+                    con.execute(f"""
+                    DELETE FROM BRONZE.{table_name}
+                    WHERE "{row_key}" IN (
+                        SELECT "{row_key}" FROM read_parquet([{file_list}], union_by_name = true) WHERE "{row_key}" IS NOT NULL
+                    )
+                    """)
+                # continue _record_id from the current maximum so ids stay monotonic across loads
+                record_id_offset = f"(SELECT COALESCE(MAX(_record_id), 0) FROM BRONZE.{table_name})"
+                con.execute(f"""
+                INSERT INTO BRONZE.{table_name} BY NAME
+                {bronze_select(file_name, load_paths, record_id_offset, layout_order_by(table_name), row_key, typed_columns)};
+                """)
+            manifest_changes = (False, stale_objects, [current_objects[name] for name in objects_to_load])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    logger.info(f"Successfully created or updated BRONZE.{table_name}")
+    return manifest_changes
+
+def load_bronze_table(con, catalog_name, logger, bucket_name, table_name, file_name, current_objects, loaded_etags, table_exists):
+    # each worker thread gets its own cursor on the shared database instance
+    cursor = con.cursor()
+    try:
+        cursor.execute(f"USE {catalog_name}")
+        return refresh_bronze_table(
+            cursor, logger, bucket_name, table_name, file_name,
+            current_objects, loaded_etags, table_exists,
+        )
+    finally:
+        cursor.close()
+
+def update_data(con, logger, bucket_name, max_workers=None, table_names=None):
+    logger.info("Starting Bronze layer ingestion")
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS BRONZE._load_manifest (
+        object_name VARCHAR,
+        table_name VARCHAR,
+        etag VARCHAR,
+        size BIGINT,
+        last_modified TIMESTAMP WITH TIME ZONE,
+        loaded_at TIMESTAMP WITH TIME ZONE
+    )
+    """)
+
+    try:
+        bucket_objects = list_bucket_objects(bucket_name)
+        logger.info(f"Found {len(bucket_objects)} files in MinIO bucket")
+
+        tables = {}
+        for object_name, obj in bucket_objects.items():
+            file_name, table_name = bronze_table_name(object_name)
+            tables.setdefault(table_name, (file_name, {}))[1][object_name] = obj
+
+        loaded = {}
+        for object_name, table_name, etag in con.execute("SELECT object_name, table_name, etag FROM BRONZE._load_manifest").fetchall():
+            loaded.setdefault(table_name, {})[object_name] = etag
+            tables.setdefault(table_name, (bronze_table_name(object_name)[0], {}))
+
+        if table_names is not None:
+            # a pipeline stage only needs the tables its inputs feed, not a sweep of the whole bucket
+            tables = {table_name: tables[table_name] for table_name in table_names if table_name in tables}
+
+        existing_tables = {
+            row[0].lower()
+            for row in con.execute(
+                "SELECT table_name FROM duckdb_tables() WHERE database_name = current_database() AND lower(schema_name) = 'bronze'"
+            ).fetchall()
+        }
+        catalog_name = con.execute("SELECT current_database()").fetchone()[0]
+
+        # tables are independent, so they load concurrently; each one's manifest update follows its load
+        max_workers = max_workers or min(len(tables), os.cpu_count() or 1) or 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for table_name, (file_name, current_objects) in tables.items():
+                logger.info(f"Processing {len(current_objects)} file(s) for {file_name} -> table: BRONZE.{table_name}")
+                futures[executor.submit(
+                    load_bronze_table,
+                    con, catalog_name, logger, bucket_name, table_name, file_name,
+                    current_objects, loaded.get(table_name, {}), table_name in existing_tables,
+                )] = table_name
+
+            for future in as_completed(futures):
+                manifest_changes = future.result()
+                if manifest_changes is not None:
+                    apply_manifest_changes(con, futures[future], *manifest_changes)
 
     except Exception as e:
         logger.error(f"Error processing files from MinIO: {e}")
-        raise
\ No newline at end of file
+        raise
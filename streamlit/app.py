@@ -3,114 +3,106 @@ import sys
 current_path = os.path.dirname(os.path.abspath(__file__))
 parent_path = os.path.abspath(os.path.join(current_path, ".."))
 sys.path.append(parent_path)
-from api.fetch_data import fetch_single_dataset
-import pandas as pd
-import polars as pl
+from api.fetch_data import DATASET_CONFIG, quote_identifier, ducklake
+import numpy as np
+import pyarrow.compute as pc
 import streamlit as st
 
+PAGE_SIZE = 500
 
-@st.cache_data(ttl=300)
-def load_dataset(dataset_id, offset, limit):
+
+@st.cache_resource(max_entries=4, show_spinner="Loading dataset...")
+def load_shared_table(dataset_id, snapshot_id, sort_column):
+    # one immutable Arrow table per (dataset, snapshot) shared by every session in the process;
+    # snapshot_id is only part of the cache key, so only a snapshot that changed this table loads a fresh copy
+    table_name = DATASET_CONFIG[dataset_id]["table_name"]
+    with ducklake.cursor() as cursor:
+        table = cursor.execute(
+            f"SELECT * FROM {table_name} ORDER BY {quote_identifier(sort_column)} DESC NULLS LAST, rowid"
+        ).fetch_arrow_table()
+
+    # ascending search keys for the descending sort column; nulls sort last as +inf
+    sort_values = table.column(sort_column).cast("double").to_numpy(zero_copy_only=False)
+    search_keys = np.where(np.isnan(sort_values), np.inf, -sort_values)
+    return table, search_keys
+
+
+def shared_table(dataset_id, sort_column):
     try:
-        data = fetch_single_dataset(dataset_id, offset, limit)
-        return data or []
+        table_name = DATASET_CONFIG[dataset_id]["table_name"]
+        return load_shared_table(dataset_id, ducklake.table_snapshot_id(table_name), sort_column)
     except Exception as exc:  # keep simple for the UI
         st.error(f"Error loading dataset {dataset_id}: {exc}")
-        return []
+        return None, None
 
 
-def to_polars(rows):
-    try:
-        return pl.DataFrame(rows)
-    except Exception:
-        return pl.from_pandas(pd.DataFrame(rows))
+def value_range_slice(table, search_keys, low, high):
+    # rows with low <= value <= high are contiguous in the descending sort, so this is a zero-copy slice
+    start = int(np.searchsorted(search_keys, -high, side="left"))
+    end = int(np.searchsorted(search_keys, -low, side="right"))
+    return table.slice(start, end - start)
+
+
+def paginated_table(dataset_id, table, view_key):
+    # page offsets into the shared table; any change to the view starts over from the first page
+    state_key = f"dataset_{dataset_id}_page"
+    if state_key not in st.session_state or st.session_state[f"{state_key}_view"] != view_key:
+        st.session_state[state_key] = 0
+        st.session_state[f"{state_key}_view"] = view_key
+    page = st.session_state[state_key]
+    page_count = max(1, -(-table.num_rows // PAGE_SIZE))
+
+    if table.num_rows == 0:
+        st.info(f"No rows returned for dataset {dataset_id}")
+        return
+    st.dataframe(table.slice(page * PAGE_SIZE, PAGE_SIZE))
+
+    previous_column, page_column, next_column = st.columns([1, 2, 1])
+    if previous_column.button("Previous", key=f"{state_key}_previous", disabled=page == 0):
+        st.session_state[state_key] = page - 1
+        st.rerun()
+    page_column.markdown(f"Page {page + 1} of {page_count} ({PAGE_SIZE} rows per page)")
+    if next_column.button("Next", key=f"{state_key}_next", disabled=page + 1 >= page_count):
+        st.session_state[state_key] = page + 1
+        st.rerun()
 
 
 def main():
     st.set_page_config(page_title="NYC Hiring Audit — Viewer", layout="wide")
     st.title("NYC Hiring Audit")
 
-    with st.spinner("Loading datasets..."):        
-        ds2 = load_dataset(2, 0, 750000)
-        df2 = to_polars(ds2)
-
-        ds3 = load_dataset(3, 0, 750000)
-        df3 = to_polars(ds3)
-
     st.header("Job Posting & Payroll: Unique Title & Salary Matches")
-    if df2.is_empty():
-        st.info("No rows returned for dataset 2")
-    else:
-        if "match_score" in df2.columns:
-            try:
-                df2 = df2.with_columns(pl.col("match_score").cast(pl.Float64))
-            except Exception:
-                pass
-
-            try:
-                df2_sorted = df2.sort("match_score", reverse=True)
-            except Exception:
-                df2_sorted = df2
-
-            try:
-                min_score = float(df2_sorted["match_score"].min())
-                max_score = float(df2_sorted["match_score"].max())
-            except Exception:
-                min_score, max_score = 0.0, 100.0
-
-            if min_score >= max_score:
-                st.info(f"All rows have match_score = {min_score:.2f}")
-                score_range = (min_score, max_score)
-            else:
-                score_range = st.slider(
-                    "match_score range (unique titles)",
-                    min_value=min_score,
-                    max_value=max_score,
-                    value=(min_score, max_score),
-                    format="%.2f"
-                )
-
-            filtered = df2_sorted.filter((pl.col("match_score") >= score_range[0]) & (pl.col("match_score") <= score_range[1]))
-            try:
-                filtered = filtered.sort("match_score", reverse=True)
-            except Exception:
-                pass
+    table, search_keys = shared_table(2, "match_score")
+    if table is not None:
+        scores = table.column("match_score")
+        min_score = float(pc.min(scores).as_py() or 0.0)
+        max_score = float(pc.max(scores).as_py() or 100.0)
+
+        if min_score >= max_score:
+            st.info(f"All rows have match_score = {min_score:.2f}")
+            score_range = (min_score, max_score)
         else:
-            df2_sorted = df2
-            filtered = df2
-
-        st.markdown(f"**Showing {filtered.height} rows** (filtered from {df2_sorted.height})")
-        try:
-            st.dataframe(filtered.to_pandas().reset_index(drop=True))
-        except Exception:
-            st.dataframe(filtered)
-
-        if "match_score" in df2.columns and filtered.height > 0:
-            try:
-                avg_score = float(filtered["match_score"].mean())
-                st.metric("Average match_score (filtered, unique titles)", f"{avg_score:.1f}")
-            except Exception:
-                pass
+            score_range = st.slider(
+                "match_score range (unique titles)",
+                min_value=min_score,
+                max_value=max_score,
+                value=(min_score, max_score),
+                format="%.2f"
+            )
+
+        filtered = value_range_slice(table, search_keys, *score_range)
+        st.markdown(f"**Showing {filtered.num_rows} rows** (filtered from {table.num_rows})")
+        if filtered.num_rows:
+            average_score = pc.mean(filtered.column("match_score")).as_py()
+            st.metric("Average match_score (filtered, unique titles)", f"{average_score:.1f}")
+
+        paginated_table(2, filtered, score_range)
 
     st.header("Unique Matched Job Posting Duration (SOC)")
-    if df3.is_empty():
-        st.info("No rows returned for dataset 3")
-    else:
-        if "median_posting_duration" in df3.columns:
-            try:
-                df3_sorted = df3.sort("median_posting_duration", reverse=True)
-            except Exception:
-                df3_sorted = df3
-        else:
-            df3_sorted = df3
-
-        st.markdown(f"**Rows: {df3_sorted.height}**")
-
-        try:
-            st.dataframe(df3_sorted.to_pandas())
-        except Exception:
-            st.dataframe(df3_sorted)
+    table, _ = shared_table(3, "median_posting_duration")
+    if table is not None:
+        st.markdown(f"**Rows: {table.num_rows}**")
+        paginated_table(3, table, None)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import polars as pl
+import pytest
+
+import data_ingestion
+from data_ingestion import build_http_session, ingest_api_delta, iter_api_pages, stream_api_data_to_minio
+
+
+class SocrataStub:
+    # serves records by $offset/$limit like a Socrata endpoint; delays and failures are set per offset
+    def __init__(self, records):
+        self.records = records
+        self.delays = {}
+        self.failures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def page(self, params):
+        offset = int(params["$offset"])
+        limit = int(params["$limit"])
+        with self.lock:
+            self.requests.append(offset)
+            failing = self.failures.get(offset, 0)
+            if failing:
+                self.failures[offset] = failing - 1
+        time.sleep(self.delays.get(offset, 0))
+        if failing:
+            return 503, {"message": "busy"}
+        return 200, self.records[offset:offset + limit]
+
+
+@pytest.fixture
+def socrata():
+    stub = SocrataStub([])
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+            status, body = stub.page(params)
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stub.url = f"http://127.0.0.1:{server.server_address[1]}/resource.json"
+    yield stub
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_pages(stub, limit, max_workers=4):
+    session = build_http_session(max_workers, backoff_factor=0)
+    return list(iter_api_pages(stub.url, limit=limit, max_workers=max_workers, session=session))
+
+
+def test_pages_are_yielded_in_offset_order_when_later_pages_finish_first(socrata):
+    socrata.records = [{"n": str(n)} for n in range(23)]
+    socrata.delays = {0: 0.3, 5: 0.15}
+
+    pages = fetch_pages(socrata, limit=5)
+
+    assert [offset for offset, _ in pages] == [0, 5, 10, 15, 20]
+    assert [record["n"] for _, batch in pages for record in batch] == [str(n) for n in range(23)]
+    assert len(pages[-1][1]) == 3
+
+
+def test_exact_multiple_ends_on_the_empty_page_without_yielding_it(socrata):
+    socrata.records = [{"n": str(n)} for n in range(20)]
+
+    pages = fetch_pages(socrata, limit=5, max_workers=2)
+
+    assert [(offset, len(batch)) for offset, batch in pages] == [(0, 5), (5, 5), (10, 5), (15, 5)]
+    assert 20 in socrata.requests
+
+
+def test_nothing_is_requested_far_past_the_short_page(socrata):
+    socrata.records = [{"n": str(n)} for n in range(7)]
+
+    pages = fetch_pages(socrata, limit=5, max_workers=3)
+
+    assert [(offset, len(batch)) for offset, batch in pages] == [(0, 5), (5, 2)]
+    # at most one window of max_workers pages is in flight when the short page arrives
+    assert max(socrata.requests) <= 5 + 3 * 5
+
+
+def test_empty_dataset_yields_nothing(socrata):
+    assert fetch_pages(socrata, limit=5) == []
+
+
+def test_transient_503_is_retried(socrata):
+    socrata.records = [{"n": str(n)} for n in range(12)]
+    socrata.failures = {5: 2}
+
+    pages = fetch_pages(socrata, limit=5)
+
+    assert [record["n"] for _, batch in pages for record in batch] == [str(n) for n in range(12)]
+    assert socrata.requests.count(5) == 3
+
+
+def test_spooled_file_keeps_columns_first_seen_on_a_later_page(socrata, tmp_path, monkeypatch):
+    # Socrata omits null fields, so "bonus" only shows up on the second page
+    socrata.records = [{"n": str(n)} for n in range(5)] + [{"n": "5", "bonus": "100"}, {"n": "6"}]
+    uploaded = {}
+
+    def fake_upload(path, logger, object_name):
+        uploaded[object_name] = pl.read_parquet(path)
+        return True
+
+    monkeypatch.setattr(data_ingestion, "upload_parquet_and_remove_local", fake_upload)
+
+    rows, latest_update = stream_api_data_to_minio.fn(
+        socrata.url, "jobs/jobs_1.parquet", limit=5, max_workers=2, spool_dir=str(tmp_path)
+    )
+
+    assert rows == 7
+    assert latest_update is None
+    frame = uploaded["jobs/jobs_1.parquet"]
+    assert frame.schema == {"n": pl.Utf8, "bonus": pl.Utf8}
+    assert frame["bonus"].to_list() == [None] * 5 + ["100", None]
+    # the per-page spools are gone once the single file is written
+    assert [path.name for path in tmp_path.iterdir()] == ["jobs_1.parquet"]
+
+
+@pytest.fixture
+def delta_state(monkeypatch):
+    # watermarks and uploads kept in memory instead of the bucket
+    state = {"watermarks": {}, "uploads": []}
+    monkeypatch.setattr(data_ingestion, "load_watermarks", lambda: dict(state["watermarks"]))
+    monkeypatch.setattr(data_ingestion, "save_watermark", lambda dataset, watermark: state["watermarks"].update({dataset: watermark}))
+    monkeypatch.setattr(data_ingestion, "remove_superseded_objects", lambda dataset, keep_object: None)
+    # the plain function, so no Prefect task run (and its API server) is started
+    monkeypatch.setattr(data_ingestion, "stream_api_data_to_minio", stream_api_data_to_minio.fn)
+
+    def fake_upload(path, logger, object_name):
+        state["uploads"].append(object_name)
+        return True
+
+    monkeypatch.setattr(data_ingestion, "upload_parquet_and_remove_local", fake_upload)
+    return state
+
+
+def test_watermark_is_the_newest_server_side_update(socrata, delta_state):
+    socrata.records = [
+        {":id": "row-1", ":updated_at": "2024-03-01T10:00:00.000Z", "n": "1"},
+        {":id": "row-2", ":updated_at": "2024-03-02T08:15:30.500Z", "n": "2"},
+        {":id": "row-3", ":updated_at": "2024-02-27T23:59:59.000Z", "n": "3"},
+    ]
+
+    assert ingest_api_delta.fn(socrata.url, "jobs") == 3
+    assert delta_state["watermarks"]["jobs"] == {"column": ":updated_at", "value": "2024-03-02T08:15:30"}
+
+
+def test_watermark_is_kept_when_nothing_changed(socrata, delta_state):
+    delta_state["watermarks"]["jobs"] = {"column": ":updated_at", "value": "2024-03-02T08:15:30"}
+
+    assert ingest_api_delta.fn(socrata.url, "jobs") == 0
+    assert delta_state["watermarks"]["jobs"] == {"column": ":updated_at", "value": "2024-03-02T08:15:30"}
+    assert delta_state["uploads"] == []
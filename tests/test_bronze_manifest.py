@@ -0,0 +1,213 @@
+import logging
+import os
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+
+import duckdb
+import polars as pl
+import pytest
+
+import utils
+from utils import bronze_select, posting_dates_sql, update_data
+
+BUCKET = "bronze-test"
+logger = logging.getLogger(__name__)
+
+
+class LocalMinio:
+    # stands in for the MinIO client: objects are Parquet files under a local directory
+    def __init__(self, root):
+        self.root = root
+        self.versions = {}
+
+    def put(self, object_name, frame):
+        path = os.path.join(self.root, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        frame.write_parquet(path)
+        self.versions[object_name] = self.versions.get(object_name, 0) + 1
+
+    def remove(self, object_name):
+        os.remove(os.path.join(self.root, object_name))
+        del self.versions[object_name]
+
+    def list_objects(self, bucket_name, recursive=False):
+        for object_name, version in sorted(self.versions.items()):
+            path = os.path.join(self.root, object_name)
+            yield SimpleNamespace(
+                object_name=object_name,
+                etag=f"{object_name}-v{version}",
+                size=os.path.getsize(path),
+                last_modified=datetime.now(timezone.utc),
+            )
+
+
+@pytest.fixture
+def bucket(tmp_path, monkeypatch):
+    client = LocalMinio(str(tmp_path))
+    monkeypatch.setattr(utils, "get_minio_client", lambda: client)
+    monkeypatch.setattr(utils, "bronze_object_path", lambda bucket_name, object_name: os.path.join(client.root, object_name))
+    return client
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    con.execute("CREATE SCHEMA BRONZE")
+    yield con
+    con.close()
+
+
+def bronze_rows(con, table_name, columns):
+    return con.execute(f"SELECT {', '.join(columns)} FROM BRONZE.{table_name} ORDER BY _record_id").fetchall()
+
+
+def manifest(con):
+    return dict(con.execute("SELECT object_name, etag FROM BRONZE._load_manifest").fetchall())
+
+
+def test_new_objects_append_and_continue_record_ids(con, bucket):
+    bucket.put("jobs/jobs_1.parquet", pl.DataFrame({"title": ["a", "b"]}))
+    update_data(con, logger, BUCKET)
+    bucket.put("jobs/jobs_2.parquet", pl.DataFrame({"title": ["c"], "agency": ["x"]}))
+    update_data(con, logger, BUCKET)
+
+    assert bronze_rows(con, "jobs", ["title", "agency", "_record_id"]) == [("a", None, 1), ("b", None, 2), ("c", "x", 3)]
+    assert set(manifest(con)) == {"jobs/jobs_1.parquet", "jobs/jobs_2.parquet"}
+
+
+def test_unchanged_bucket_is_skipped(con, bucket):
+    bucket.put("jobs/jobs_1.parquet", pl.DataFrame({"title": ["a"]}))
+    update_data(con, logger, BUCKET)
+    loaded_at = con.execute("SELECT max(_ingestion_timestamp) FROM BRONZE.jobs").fetchone()[0]
+    update_data(con, logger, BUCKET)
+
+    assert con.execute("SELECT max(_ingestion_timestamp) FROM BRONZE.jobs").fetchone()[0] == loaded_at
+    assert con.execute("SELECT count(*) FROM BRONZE._load_manifest").fetchone()[0] == 1
+
+
+def test_changed_object_replaces_its_rows(con, bucket):
+    bucket.put("jobs/jobs_1.parquet", pl.DataFrame({"title": ["a", "b"]}))
+    bucket.put("jobs/jobs_2.parquet", pl.DataFrame({"title": ["c"]}))
+    update_data(con, logger, BUCKET)
+    bucket.put("jobs/jobs_1.parquet", pl.DataFrame({"title": ["a2"]}))
+    update_data(con, logger, BUCKET)
+
+    assert bronze_rows(con, "jobs", ["title", "_record_id"]) == [("c", 3), ("a2", 4)]
+    assert manifest(con)["jobs/jobs_1.parquet"] == "jobs/jobs_1.parquet-v2"
+
+
+def test_removed_objects_drop_rows_then_table(con, bucket):
+    bucket.put("jobs/jobs_1.parquet", pl.DataFrame({"title": ["a"]}))
+    bucket.put("jobs/jobs_2.parquet", pl.DataFrame({"title": ["b"]}))
+    update_data(con, logger, BUCKET)
+
+    bucket.remove("jobs/jobs_1.parquet")
+    update_data(con, logger, BUCKET)
+    assert bronze_rows(con, "jobs", ["title"]) == [("b",)]
+    assert set(manifest(con)) == {"jobs/jobs_2.parquet"}
+
+    bucket.remove("jobs/jobs_2.parquet")
+    update_data(con, logger, BUCKET)
+    assert con.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = 'jobs'").fetchone()[0] == 0
+    assert manifest(con) == {}
+
+
+def test_type_change_rebuilds_the_table(con, bucket):
+    bucket.put("jobs/jobs_1.parquet", pl.DataFrame({"title": ["a"], "posted": ["2025-01-02"]}))
+    update_data(con, logger, BUCKET)
+    bucket.put(
+        "jobs/jobs_1.parquet",
+        pl.DataFrame({"title": ["a"], "posted": ["2025-01-02"]}).with_columns(pl.col("posted").str.to_date()),
+    )
+    update_data(con, logger, BUCKET)
+
+    assert dict(con.execute("SELECT column_name, column_type FROM (DESCRIBE BRONZE.jobs)").fetchall())["posted"] == "DATE"
+    # a rebuild reloads every current object once, so ids start over
+    assert bronze_rows(con, "jobs", ["title", "_record_id"]) == [("a", 1)]
+
+
+def test_delta_partitions_supersede_earlier_row_versions(con, bucket):
+    bucket.put("jobs/jobs_1.parquet", pl.DataFrame({":id": ["r1", "r2"], "title": ["a", "b"]}))
+    bucket.put("jobs/jobs_2.parquet", pl.DataFrame({":id": ["r1"], "title": ["a2"]}))
+    update_data(con, logger, BUCKET)
+    assert sorted(bronze_rows(con, "jobs", ['":id"', "title"])) == [("r1", "a2"), ("r2", "b")]
+
+    bucket.put("jobs/jobs_3.parquet", pl.DataFrame({":id": ["r2", "r3"], "title": ["b2", "c"]}))
+    update_data(con, logger, BUCKET)
+    assert sorted(bronze_rows(con, "jobs", ['":id"', "title"])) == [("r1", "a2"), ("r2", "b2"), ("r3", "c")]
+
+
+def test_table_names_limits_the_sync(con, bucket):
+    bucket.put("jobs/jobs_1.parquet", pl.DataFrame({"title": ["a"]}))
+    bucket.put("payroll/payroll_1.parquet", pl.DataFrame({"title": ["p"]}))
+    update_data(con, logger, BUCKET, table_names=["payroll"])
+
+    assert set(manifest(con)) == {"payroll/payroll_1.parquet"}
+    assert bronze_rows(con, "payroll", ["title"]) == [("p",)]
+
+
+def typed_postings(con, path, frame):
+    frame.write_parquet(path)
+    select = bronze_select("postings", [str(path)], 0, typed_columns=posting_dates_sql(frame.columns))
+    types = dict(con.execute(f"SELECT column_name, column_type FROM (DESCRIBE {select})").fetchall())
+    rows = con.execute(
+        f"SELECT business_title, posting_date, post_until, posting_duration_days FROM ({select}) ORDER BY business_title"
+    ).fetchall()
+    return rows, types
+
+
+def test_posting_dates_are_typed_with_the_post_until_fallback(con, tmp_path):
+    rows, types = typed_postings(con, tmp_path / "postings.parquet", pl.DataFrame({
+        "business_title": ["a", "b", "c", "d", "e"],
+        "posting_date": ["2025-01-02T00:00:00.000", "2025-01-02T00:00:00.000", "2025-01-02T00:00:00.000", "not a date", None],
+        "post_until": ["15-JAN-2025", None, "someday", "15-JAN-2025", None],
+    }))
+
+    assert rows == [
+        ("a", date(2025, 1, 2), date(2025, 1, 15), 13),
+        # missing or unparseable post_until: posting_date + 30 days
+        ("b", date(2025, 1, 2), date(2025, 2, 1), 30),
+        ("c", date(2025, 1, 2), date(2025, 2, 1), 30),
+        # an unparseable posting_date becomes NULL, and so does the duration
+        ("d", None, date(2025, 1, 15), None),
+        ("e", None, None, None),
+    ]
+    assert (types["posting_date"], types["post_until"], types["posting_duration_days"]) == ("DATE", "DATE", "INTEGER")
+
+
+def test_files_without_post_until_still_get_the_fallback(con, tmp_path):
+    rows, _ = typed_postings(con, tmp_path / "postings.parquet", pl.DataFrame({
+        "business_title": ["a"], "posting_date": ["2025-03-01T12:30:00.000"],
+    }))
+    assert rows == [("a", date(2025, 3, 1), date(2025, 3, 31), 30)]
+
+
+def test_job_postings_table_loaded_as_strings_is_retyped(con, bucket, monkeypatch):
+    # DuckLake partitioning options do not apply to a plain DuckDB database
+    monkeypatch.setattr(utils, "apply_table_layout", lambda con, table_name: None)
+    bucket.put("nyc_job_postings_data/postings_1.parquet", pl.DataFrame({
+        "business_title": ["a"], "posting_date": ["2025-01-02T00:00:00.000"], "post_until": ["not listed"],
+    }))
+    # as loaded before the dates were typed at bronze load time
+    monkeypatch.delitem(utils.BRONZE_TYPED_COLUMNS, "nyc_job_postings_data")
+    update_data(con, logger, BUCKET)
+    assert dict(con.execute("SELECT column_name, column_type FROM (DESCRIBE BRONZE.nyc_job_postings_data)").fetchall())["posting_date"] == "VARCHAR"
+    utils.BRONZE_TYPED_COLUMNS["nyc_job_postings_data"] = posting_dates_sql
+
+    bucket.put("nyc_job_postings_data/postings_2.parquet", pl.DataFrame({
+        "business_title": ["b"], "posting_date": ["2025-01-05T00:00:00.000"], "post_until": ["10-JAN-2025"],
+    }))
+    update_data(con, logger, BUCKET)
+
+    assert bronze_rows(con, "nyc_job_postings_data", ["business_title", "post_until", "posting_duration_days"]) == [
+        ("a", date(2025, 2, 1), 30), ("b", date(2025, 1, 10), 5),
+    ]
+    types = dict(con.execute("SELECT column_name, column_type FROM (DESCRIBE BRONZE.nyc_job_postings_data)").fetchall())
+    assert (types["posting_date"], types["post_until"]) == ("DATE", "DATE")
+
+    # further loads append without another rebuild
+    bucket.put("nyc_job_postings_data/postings_3.parquet", pl.DataFrame({
+        "business_title": ["c"], "posting_date": ["2025-01-06T00:00:00.000"], "post_until": ["16-JAN-2025"],
+    }))
+    update_data(con, logger, BUCKET)
+    assert bronze_rows(con, "nyc_job_postings_data", ["business_title", "_record_id"]) == [("a", 1), ("b", 2), ("c", 3)]
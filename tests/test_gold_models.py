@@ -0,0 +1,196 @@
+import threading
+
+import duckdb
+import pytest
+
+import cleaned_data
+from cleaned_data import parse_gold_models, run_gold_models, select_gold_models
+
+SCRIPT = """
+-- salary matches
+CREATE TABLE IF NOT EXISTS GOLD.salary_matches AS
+SELECT
+    business_title AS posted_job_title,
+    match_score
+FROM BRONZE.payroll_to_jobs_title_fuzzy_matches
+ORDER BY match_score DESC;
+
+CREATE TABLE IF NOT EXISTS GOLD.salary_matches_unique AS
+SELECT DISTINCT posted_job_title, match_score
+FROM GOLD.salary_matches
+ORDER BY match_score DESC;
+
+CREATE TABLE IF NOT EXISTS GOLD.durations AS
+SELECT
+    business_title AS title,
+    median_posting_duration
+FROM BRONZE.jobs_to_lightcast_title_fuzzy_matches
+ORDER BY median_posting_duration DESC;
+
+CREATE TABLE IF NOT EXISTS GOLD.salary_durations AS
+SELECT s.posted_job_title, d.median_posting_duration
+FROM GOLD.salary_matches_unique AS s
+JOIN GOLD.durations AS d ON s.posted_job_title = d.title;
+"""
+
+
+def models_by_name(models):
+    return {model["table_name"]: model for model in models}
+
+
+def test_parse_gold_models_reads_sources_keys_and_dependencies():
+    models = models_by_name(parse_gold_models(SCRIPT))
+    assert list(models) == ["GOLD.salary_matches", "GOLD.salary_matches_unique", "GOLD.durations", "GOLD.salary_durations"]
+
+    salary = models["GOLD.salary_matches"]
+    assert salary["source_table"] == "payroll_to_jobs_title_fuzzy_matches"
+    assert salary["key_column"] == "posted_job_title"
+    assert salary["select_sql"].startswith("SELECT") and salary["select_sql"].endswith("DESC")
+    assert salary["depends_on"] == set()
+
+    # models over other gold tables have no bronze source or key and are rebuilt in full
+    unique = models["GOLD.salary_matches_unique"]
+    assert unique["source_table"] is None
+    assert unique["key_column"] is None
+    assert unique["depends_on"] == {"GOLD.salary_matches"}
+
+    assert models["GOLD.durations"]["key_column"] == "title"
+    assert models["GOLD.salary_durations"]["depends_on"] == {"GOLD.salary_matches_unique", "GOLD.durations"}
+
+
+def test_parse_gold_models_reads_the_shipped_script():
+    with open("sql/cleaned.sql") as f:
+        models = parse_gold_models(f.read())
+    assert models
+    assert all(model["source_table"] and model["key_column"] for model in models)
+
+
+def test_select_gold_models_adds_everything_downstream():
+    models = parse_gold_models(SCRIPT)
+    selected = [model["table_name"] for model in select_gold_models(models, ["payroll_to_jobs_title_fuzzy_matches"])]
+    assert selected == ["GOLD.salary_matches", "GOLD.salary_matches_unique", "GOLD.salary_durations"]
+
+    selected = [model["table_name"] for model in select_gold_models(models, ["jobs_to_lightcast_title_fuzzy_matches"])]
+    assert selected == ["GOLD.durations", "GOLD.salary_durations"]
+
+    assert select_gold_models(models, ["nyc_payroll_data"]) == []
+
+
+class BuildLog(list):
+    # models in the order they were built; models named in failing raise instead
+    failing = None
+
+
+@pytest.fixture
+def build_log(monkeypatch):
+    # stands in for run_gold_model, so the scheduler runs without DuckLake
+    log = BuildLog()
+    log.failing = set()
+    lock = threading.Lock()
+
+    def fake_run_gold_model(con, catalog_name, model):
+        if model["table_name"] in log.failing:
+            raise RuntimeError("boom")
+        with lock:
+            log.append(model["table_name"])
+
+    monkeypatch.setattr(cleaned_data, "run_gold_model", fake_run_gold_model)
+    return log
+
+
+def test_run_gold_models_builds_dependencies_first(build_log):
+    run_gold_models(None, "lake", parse_gold_models(SCRIPT), max_workers=4)
+    assert set(build_log) == {"GOLD.salary_matches", "GOLD.salary_matches_unique", "GOLD.durations", "GOLD.salary_durations"}
+    assert build_log.index("GOLD.salary_matches") < build_log.index("GOLD.salary_matches_unique")
+    assert build_log[-1] == "GOLD.salary_durations"
+
+
+def test_run_gold_models_skips_dependents_of_a_failed_model(build_log):
+    build_log.failing.add("GOLD.salary_matches")
+    with pytest.raises(RuntimeError) as error:
+        run_gold_models(None, "lake", parse_gold_models(SCRIPT), max_workers=2)
+    # the independent model still builds; everything downstream of the failure is skipped and reported
+    assert build_log == ["GOLD.durations"]
+    assert str(error.value) == (
+        "Gold model(s) failed: GOLD.salary_durations, GOLD.salary_matches, GOLD.salary_matches_unique"
+    )
+
+
+def test_run_gold_models_only_waits_on_selected_dependencies(build_log):
+    models = select_gold_models(parse_gold_models(SCRIPT), ["jobs_to_lightcast_title_fuzzy_matches"])
+    run_gold_models(None, "lake", models)
+    assert build_log == ["GOLD.durations", "GOLD.salary_durations"]
+
+
+def test_run_gold_models_rejects_cycles(build_log):
+    script = SCRIPT + """
+    CREATE TABLE IF NOT EXISTS GOLD.a AS SELECT * FROM GOLD.b;
+    CREATE TABLE IF NOT EXISTS GOLD.b AS SELECT * FROM GOLD.a;
+    """
+    with pytest.raises(ValueError, match="Circular dependency between gold models: GOLD.a, GOLD.b"):
+        run_gold_models(None, "lake", parse_gold_models(script))
+
+
+@pytest.fixture
+def lake():
+    # a plain DuckDB database with the DuckLake catalog tables input_snapshot_id reads and a stand-in change feed
+    con = duckdb.connect()
+    con.execute("CREATE SCHEMA BRONZE")
+    con.execute("CREATE SCHEMA GOLD")
+    con.execute("CREATE SCHEMA __ducklake_metadata_memory")
+    con.execute("CREATE TABLE __ducklake_metadata_memory.ducklake_schema (schema_id BIGINT, begin_snapshot BIGINT, end_snapshot BIGINT, schema_name VARCHAR)")
+    con.execute("CREATE TABLE __ducklake_metadata_memory.ducklake_table (table_id BIGINT, begin_snapshot BIGINT, end_snapshot BIGINT, schema_id BIGINT, table_name VARCHAR)")
+    con.execute("CREATE TABLE __ducklake_metadata_memory.ducklake_data_file (table_id BIGINT, begin_snapshot BIGINT, end_snapshot BIGINT)")
+    con.execute("CREATE TABLE __ducklake_metadata_memory.ducklake_delete_file (table_id BIGINT, begin_snapshot BIGINT, end_snapshot BIGINT)")
+    con.execute("INSERT INTO __ducklake_metadata_memory.ducklake_schema VALUES (1, 1, NULL, 'BRONZE'), (2, 1, NULL, 'GOLD')")
+    con.execute("""
+        INSERT INTO __ducklake_metadata_memory.ducklake_table VALUES
+            (10, 2, NULL, 1, 'payroll_to_jobs_title_fuzzy_matches'),
+            (11, 2, NULL, 1, 'jobs_to_lightcast_title_fuzzy_matches')
+    """)
+    con.execute("INSERT INTO __ducklake_metadata_memory.ducklake_data_file VALUES (10, 3, NULL), (11, 2, NULL)")
+
+    con.execute("CREATE TABLE BRONZE.payroll_to_jobs_title_fuzzy_matches (business_title VARCHAR, match_score DOUBLE)")
+    con.execute("INSERT INTO BRONZE.payroll_to_jobs_title_fuzzy_matches VALUES ('Clerk', 80), ('Engineer', 90), ('Planner', 70)")
+    con.execute("CREATE TABLE changed_titles (business_title VARCHAR)")
+    con.execute("CREATE MACRO ducklake_table_changes(catalog_name, schema_name, table_name, start_snapshot, end_snapshot) AS TABLE SELECT * FROM changed_titles")
+    con.execute("""
+        CREATE TABLE GOLD._materializations (
+            table_name VARCHAR, source_table VARCHAR, source_snapshot_id BIGINT, refreshed_at TIMESTAMP WITH TIME ZONE
+        )
+    """)
+    yield con
+    con.close()
+
+
+def materialize(lake):
+    model = parse_gold_models(SCRIPT)[0]
+    cleaned_data.materialize_gold_model(lake.cursor(), "memory", model)
+    return lake.execute("SELECT source_snapshot_id FROM GOLD._materializations ORDER BY source_snapshot_id").fetchall()
+
+
+def test_unchanged_inputs_skip_without_writing(lake):
+    assert materialize(lake) == [(3,)]
+    # a commit to an unrelated table moves the global snapshot, not the model's input
+    lake.execute("INSERT INTO __ducklake_metadata_memory.ducklake_data_file VALUES (11, 5, NULL)")
+    assert materialize(lake) == [(3,)]
+
+
+def test_empty_change_feed_skips_without_writing(lake):
+    materialize(lake)
+    lake.execute("INSERT INTO __ducklake_metadata_memory.ducklake_data_file VALUES (10, 6, NULL)")
+    assert materialize(lake) == [(3,)]
+    assert lake.execute("SELECT count(*) FROM GOLD.salary_matches").fetchone()[0] == 3
+
+
+def test_changed_groups_are_refreshed_up_to_the_sources_last_change(lake):
+    materialize(lake)
+    lake.execute("UPDATE BRONZE.payroll_to_jobs_title_fuzzy_matches SET match_score = 85 WHERE business_title = 'Clerk'")
+    lake.execute("INSERT INTO changed_titles VALUES ('Clerk')")
+    lake.execute("INSERT INTO __ducklake_metadata_memory.ducklake_delete_file VALUES (10, 6, NULL)")
+    lake.execute("INSERT INTO __ducklake_metadata_memory.ducklake_data_file VALUES (10, 6, NULL), (11, 8, NULL)")
+
+    assert materialize(lake) == [(3,), (6,)]
+    assert sorted(lake.execute("SELECT * FROM GOLD.salary_matches").fetchall()) == [
+        ("Clerk", 85.0), ("Engineer", 90.0), ("Planner", 70.0)
+    ]
@@ -0,0 +1,168 @@
+import duckdb
+import pytest
+from fastapi import HTTPException
+
+import fetch_data
+from fetch_data import decode_cursor, encode_cursor, open_dataset_page
+
+TABLE_ROWS = [
+    # (match_id, posted_job_title, matched_actual_payroll_title, match_score, fiscal_year)
+    (1, "Data Analyst", "DATA ANALYST", 95.0, 2024),
+    (2, "Civil Engineer", "CIVIL ENGINEER", 88.5, 2025),
+    (3, "Clerk", "CLERK", None, 2024),
+    (4, "Data Analyst", "DATA ANALYST II", 95.0, 2025),
+    (5, "Analyst's Aide", "ANALYST AIDE", 88.5, 2024),
+    (6, "Clerk", "CLERICAL ASSOCIATE", 72.0, None),
+    (7, None, "PLANNER", None, 2025),
+    (8, "Planner", "CITY PLANNER", 95.0, 2024),
+    (9, "Engineer", "ENGINEER", 72.0, 2025),
+    (10, "Data Analyst", "DATA SCIENTIST", 88.5, 2024),
+    (11, "Clerk", "CLERK", 100.0, 2025),
+]
+
+
+class MemoryLake:
+    # stands in for the DuckLake connection manager with the same GOLD table in an in-memory database
+    def __init__(self, con):
+        self.con = con
+
+    def open_cursor(self):
+        return self.con.cursor()
+
+
+@pytest.fixture(autouse=True)
+def lake(monkeypatch):
+    con = duckdb.connect()
+    con.execute("CREATE SCHEMA GOLD")
+    con.execute("""
+        CREATE TABLE GOLD.nyc_salary_matches (
+            match_id INTEGER, posted_job_title VARCHAR, matched_actual_payroll_title VARCHAR,
+            match_score DOUBLE, fiscal_year INTEGER
+        )
+    """)
+    con.executemany("INSERT INTO GOLD.nyc_salary_matches VALUES (?, ?, ?, ?, ?)", TABLE_ROWS)
+    monkeypatch.setattr(fetch_data, "ducklake", MemoryLake(con))
+    yield con
+    con.close()
+
+
+def page_through(page_size, **query):
+    ids = []
+    cursor = None
+    while True:
+        db_cursor, reader, cursor = open_dataset_page(0, cursor, page_size, columns="match_id", **query)
+        try:
+            page = reader.read_all().column("match_id").to_pylist()
+        finally:
+            db_cursor.close()
+        assert len(page) <= page_size
+        ids.extend(page)
+        if cursor is None:
+            return ids
+        assert len(page) == page_size
+
+
+def expected_ids(lake, order_by=None, where_sql="", params=()):
+    # without order_by a report pages in its model's own ORDER BY
+    order_by = order_by or fetch_data.DATASET_CONFIG[0]["default_order_by"]
+    column = order_by.lstrip("-")
+    direction = "DESC" if order_by.startswith("-") else "ASC"
+    order_sql = f'"{column}" {direction} NULLS LAST, rowid'
+    return [row[0] for row in lake.execute(
+        f"SELECT match_id FROM GOLD.nyc_salary_matches {where_sql} ORDER BY {order_sql}", list(params)
+    ).fetchall()]
+
+
+ORDERINGS = [None] + [
+    prefix + column
+    for column in ["match_id", "posted_job_title", "matched_actual_payroll_title", "match_score", "fiscal_year"]
+    for prefix in ("", "-")
+]
+
+
+@pytest.mark.parametrize("order_by", ORDERINGS)
+@pytest.mark.parametrize("page_size", [1, 2, 3, 5, 11, 50])
+def test_pages_cover_every_row_once_in_order(lake, order_by, page_size):
+    ids = page_through(page_size, order_by=order_by)
+    assert ids == expected_ids(lake, order_by)
+    assert sorted(ids) == list(range(1, len(TABLE_ROWS) + 1))
+
+
+@pytest.mark.parametrize("order_by", ORDERINGS)
+@pytest.mark.parametrize("page_size", [1, 2, 4])
+def test_pages_with_filters_cover_every_matching_row_once(lake, order_by, page_size):
+    ids = page_through(page_size, order_by=order_by, min_score=80, title_contains="analyst")
+    expected = expected_ids(
+        lake, order_by,
+        "WHERE match_score >= ? AND (contains(lower(posted_job_title), ?) OR contains(lower(matched_actual_payroll_title), ?))",
+        [80, "analyst", "analyst"],
+    )
+    assert ids == expected
+    assert len(set(ids)) == len(ids) == 4
+
+
+@pytest.mark.parametrize("order_by", ["match_score", "-match_score", "posted_job_title", "-fiscal_year"])
+def test_null_sort_values_page_last(lake, order_by):
+    ids = page_through(2, order_by=order_by, fiscal_year=2025)
+    column = order_by.lstrip("-")
+    values = dict(lake.execute(f'SELECT match_id, "{column}" FROM GOLD.nyc_salary_matches').fetchall())
+    seen_null = False
+    for row_id in ids:
+        if values[row_id] is None:
+            seen_null = True
+        else:
+            assert not seen_null
+    assert ids == expected_ids(lake, order_by, "WHERE fiscal_year = ?", [2025])
+
+
+def test_last_full_page_ends_with_an_empty_page(lake):
+    db_cursor, reader, cursor = open_dataset_page(0, None, len(TABLE_ROWS), columns="match_id")
+    db_cursor.close()
+    assert cursor is not None
+    db_cursor, reader, cursor = open_dataset_page(0, cursor, len(TABLE_ROWS), columns="match_id")
+    assert reader.read_all().num_rows == 0
+    db_cursor.close()
+    assert cursor is None
+
+
+def test_cursor_round_trips_sort_value_and_key():
+    for sort_value, sort_key in [(95.0, 3), (None, 7), ("Analyst's Aide", 0), (2024, 12)]:
+        assert decode_cursor(encode_cursor(sort_value, sort_key)) == (sort_value, sort_key)
+
+
+def test_invalid_cursor_is_a_bad_request():
+    with pytest.raises(HTTPException) as error:
+        open_dataset_page(0, "not-a-cursor", 10)
+    assert error.value.status_code == 400
+
+
+class WriteBetweenQueries:
+    # a cursor that commits a new top-scoring row right after the next_cursor query, before the body is read
+    def __init__(self, cursor, con):
+        self.cursor = cursor
+        self.con = con
+
+    def execute(self, sql, *args):
+        result = self.cursor.execute(sql, *args)
+        if "COUNT(*) OVER ()" in sql:
+            self.con.cursor().execute(
+                "INSERT INTO GOLD.nyc_salary_matches VALUES (12, 'Director', 'DIRECTOR', 99.0, 2025)"
+            )
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def test_next_cursor_and_body_read_the_same_snapshot(lake, monkeypatch):
+    monkeypatch.setattr(fetch_data.ducklake, "open_cursor", lambda: WriteBetweenQueries(lake.cursor(), lake))
+
+    db_cursor, reader, next_cursor = open_dataset_page(0, None, 3, columns="match_id,match_score")
+    try:
+        page = reader.read_all().to_pylist()
+    finally:
+        db_cursor.close()
+
+    # the row committed in between is not in this page, and the cursor points at the body's last row
+    assert [row["match_id"] for row in page] == [11, 1, 4]
+    assert decode_cursor(next_cursor) == (95.0, 3)  # match 4 is rowid 3
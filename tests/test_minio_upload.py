@@ -0,0 +1,88 @@
+import io
+import logging
+import os
+
+import utils
+from utils import upload_file_to_minio, upload_parquet_and_remove_local, upload_stream_to_minio
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingMinio:
+    # stands in for the MinIO client: records put_object arguments and reads the stream part by part like minio does
+    def __init__(self):
+        self.calls = []
+        self.read_sizes = []
+        self.uploaded = b""
+
+    def put_object(self, bucket_name, object_name, data, length, content_type, part_size, num_parallel_uploads):
+        self.calls.append({
+            "bucket_name": bucket_name,
+            "object_name": object_name,
+            "data": data,
+            "position_at_call": data.tell(),
+            "length": length,
+            "content_type": content_type,
+            "part_size": part_size,
+            "num_parallel_uploads": num_parallel_uploads,
+        })
+        while True:
+            part = data.read(part_size)
+            if not part:
+                break
+            self.read_sizes.append(len(part))
+            self.uploaded += part
+        return object_name
+
+
+def test_upload_file_passes_the_open_handle_and_part_settings(tmp_path):
+    payload = os.urandom(10_000)
+    path = tmp_path / "matches.parquet"
+    path.write_bytes(payload)
+    client = RecordingMinio()
+
+    upload_file_to_minio(str(path), "bucket", "matches.parquet", client=client, part_size=4096, num_parallel_uploads=3)
+
+    call, = client.calls
+    # the file object itself reaches put_object, unread, rather than a bytes copy of it
+    assert isinstance(call["data"], io.BufferedReader)
+    assert call["data"].name == str(path)
+    assert call["position_at_call"] == 0
+    assert call["length"] == len(payload)
+    assert (call["bucket_name"], call["object_name"]) == ("bucket", "matches.parquet")
+    assert (call["part_size"], call["num_parallel_uploads"]) == (4096, 3)
+    assert client.read_sizes == [4096, 4096, 1808]
+    assert client.uploaded == payload
+    assert call["data"].closed
+
+
+def test_upload_stream_uses_configured_defaults():
+    client = RecordingMinio()
+    upload_stream_to_minio(io.BytesIO(b"abc"), 3, "bucket", "state.json", client=client)
+
+    call, = client.calls
+    assert call["part_size"] == utils.MINIO_PART_SIZE
+    assert call["num_parallel_uploads"] == utils.MINIO_PARALLEL_UPLOADS
+    assert client.uploaded == b"abc"
+
+
+def test_upload_parquet_and_remove_local(tmp_path, monkeypatch):
+    path = tmp_path / "jobs.parquet"
+    path.write_bytes(b"parquet bytes")
+    client = RecordingMinio()
+    monkeypatch.setattr(utils, "get_minio_client", lambda: client)
+    monkeypatch.setenv("MINIO_BUCKET_NAME", "bronze")
+
+    assert upload_parquet_and_remove_local(str(path), logger, object_name="jobs/jobs_1.parquet") is True
+    assert client.calls[0]["object_name"] == "jobs/jobs_1.parquet"
+    assert client.uploaded == b"parquet bytes"
+    assert not path.exists()
+
+
+def test_upload_is_skipped_without_a_bucket(tmp_path, monkeypatch):
+    path = tmp_path / "jobs.parquet"
+    path.write_bytes(b"parquet bytes")
+    monkeypatch.delenv("MINIO_BUCKET_NAME", raising=False)
+
+    assert upload_parquet_and_remove_local(str(path), logger) is False
+    assert path.exists()
@@ -0,0 +1,213 @@
+import asyncio
+import threading
+import time
+
+import duckdb
+import pytest
+from fastapi import HTTPException
+
+from database import DuckLakeConnectionManager, QueryExecutor
+
+SLOW_QUERY = "SELECT count(*) FROM range(1000000000000) a"
+
+
+class MemoryLake(DuckLakeConnectionManager):
+    # same leasing and cursor tracking, over a plain in-memory database instead of the DuckLake catalog
+    def connect(self):
+        return duckdb.connect()
+
+
+@pytest.fixture
+def lake():
+    lake = MemoryLake(catalog_name="memory", attach_ttl=60)
+    yield lake
+    lake.close()
+
+
+@pytest.fixture
+def executor():
+    executor = QueryExecutor(max_workers=1, max_queue=0, timeout=0.3)
+    executor.start()
+    yield executor
+    executor.shutdown()
+
+
+def test_timed_out_query_is_interrupted_before_the_slot_is_freed(lake, executor):
+    def slow_report():
+        with lake.cursor() as cursor:
+            return cursor.execute(SLOW_QUERY).fetchall()
+
+    async def request():
+        executor.admit()
+        try:
+            return await executor.run(slow_report)
+        finally:
+            executor.release()
+
+    started = time.monotonic()
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(request())
+    assert error.value.status_code == 503
+    assert time.monotonic() - started < 5
+    assert executor.active == 0
+    assert lake.state()["open_cursors"] == 0
+
+    # the single worker is free again rather than still scanning
+    assert asyncio.run(executor.run(lambda: threading.current_thread().name)).startswith("duckdb-query")
+
+
+def test_timed_out_query_still_queued_is_cancelled(executor):
+    blocker = threading.Event()
+    ran = []
+
+    async def requests():
+        busy = asyncio.ensure_future(executor.run(blocker.wait, 5))
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException):
+            await executor.run(ran.append, "queued")
+        blocker.set()
+        # not interruptible, so it times out too but only returns once the worker is done
+        with pytest.raises(HTTPException):
+            await busy
+
+    asyncio.run(requests())
+    assert ran == []
+
+
+def test_body_pull_that_times_out_interrupts_its_cursor(lake, executor):
+    def open_body():
+        cursor = lake.open_cursor()
+
+        def chunks():
+            try:
+                yield b"first"
+                yield str(cursor.execute(SLOW_QUERY).fetchall()).encode()
+            finally:
+                cursor.close()
+
+        return executor.iterate(chunks())
+
+    async def request():
+        executor.admit()
+        body = await executor.run(open_body)
+        received = []
+        with pytest.raises(HTTPException):
+            async for chunk in body:
+                received.append(chunk)
+        return received
+
+    started = time.monotonic()
+    assert asyncio.run(request()) == [b"first"]
+    assert time.monotonic() - started < 5
+    assert executor.active == 0
+    assert lake.state()["open_cursors"] == 0
+
+
+def test_fast_query_returns_its_result(lake, executor):
+    def report():
+        with lake.cursor() as cursor:
+            return cursor.execute("SELECT 42").fetchone()[0]
+
+    assert asyncio.run(executor.run(report)) == 42
+    assert lake.state()["open_cursors"] == 0
+
+
+class SlowAttachLake(MemoryLake):
+    # every attach after the first waits until the test lets it finish
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attaching = threading.Event()
+        self.finish_attach = threading.Event()
+        self.connections = []
+
+    def connect(self):
+        if self.connections:
+            self.attaching.set()
+            self.finish_attach.wait(5)
+        connection = super().connect()
+        self.connections.append(connection)
+        return connection
+
+
+def test_slow_attach_does_not_block_cursors_on_the_old_attachment():
+    lake = SlowAttachLake(catalog_name="memory", attach_ttl=60)
+    try:
+        old_cursor = lake.open_cursor()
+        lake.close()
+        opened = []
+        attaching = threading.Thread(target=lambda: opened.append(lake.open_cursor()))
+        attaching.start()
+        assert lake.attaching.wait(5)
+
+        # while the new attachment is still being made, the old one is still usable and can be released
+        started = time.monotonic()
+        assert old_cursor.execute("SELECT 1").fetchone() == (1,)
+        old_cursor.close()
+        assert lake.state()["retired_attachments_open"] == 0
+        assert time.monotonic() - started < 1
+
+        lake.finish_attach.set()
+        attaching.join(5)
+        opened[0].close()
+        assert lake.state()["open_cursors"] == 0
+    finally:
+        lake.finish_attach.set()
+        lake.close()
+
+
+def test_concurrent_attaches_share_one_attachment():
+    lake = SlowAttachLake(catalog_name="memory", attach_ttl=60)
+    try:
+        lake.open()
+        lake.close()
+        cursors = []
+        threads = [threading.Thread(target=lambda: cursors.append(lake.open_cursor())) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        assert lake.attaching.wait(5)
+        time.sleep(0.05)
+        lake.finish_attach.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert lake.state()["open_cursors"] == 3
+        assert lake.state()["retired_attachments_open"] == 0
+        for cursor in cursors:
+            cursor.close()
+        assert lake.state()["open_cursors"] == 0
+    finally:
+        lake.close()
+
+
+def test_table_snapshot_id_is_the_last_snapshot_that_changed_the_table(lake):
+    # the DuckLake catalog tables table_snapshot_id reads, with only the columns it uses
+    with lake.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA __ducklake_metadata_memory")
+        for table_sql in [
+            "ducklake_schema (schema_id BIGINT, begin_snapshot BIGINT, end_snapshot BIGINT, schema_name VARCHAR)",
+            "ducklake_table (table_id BIGINT, begin_snapshot BIGINT, end_snapshot BIGINT, schema_id BIGINT, table_name VARCHAR)",
+            "ducklake_data_file (table_id BIGINT, begin_snapshot BIGINT, end_snapshot BIGINT)",
+            "ducklake_delete_file (table_id BIGINT, begin_snapshot BIGINT, end_snapshot BIGINT)",
+        ]:
+            cursor.execute(f"CREATE TABLE __ducklake_metadata_memory.{table_sql}")
+        cursor.execute("INSERT INTO __ducklake_metadata_memory.ducklake_schema VALUES (0, 0, NULL, 'main'), (1, 1, NULL, 'GOLD')")
+        cursor.execute("""
+            INSERT INTO __ducklake_metadata_memory.ducklake_table VALUES
+                (1, 2, 7, 1, 'salary_matches'),   -- replaced at snapshot 7
+                (2, 7, NULL, 1, 'salary_matches'),
+                (3, 3, NULL, 1, 'durations'),
+                (4, 4, NULL, 1, 'untouched'),
+                (5, 5, NULL, 0, 'nyc_payroll_data')
+        """)
+        cursor.execute("""
+            INSERT INTO __ducklake_metadata_memory.ducklake_data_file VALUES
+                (1, 2, 7), (2, 7, NULL), (2, 8, NULL), (3, 3, 9), (3, 9, NULL), (5, 12, NULL)
+        """)
+        cursor.execute("INSERT INTO __ducklake_metadata_memory.ducklake_delete_file VALUES (2, 10, NULL)")
+
+    assert lake.table_snapshot_id("GOLD.salary_matches") == 10
+    assert lake.table_snapshot_id("GOLD.durations") == 9
+    # created and never written to since
+    assert lake.table_snapshot_id("GOLD.untouched") == 4
+    assert lake.table_snapshot_id("nyc_payroll_data") == 12
+    assert lake.table_snapshot_id("GOLD.missing") is None
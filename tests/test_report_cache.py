@@ -0,0 +1,134 @@
+import json
+
+import pytest
+
+import fetch_data
+from fetch_data import ReportCache, cache_stream, serve_cached_json, serve_report
+
+
+class SnapshotLake:
+    # only the tables' snapshot ids are needed for cached and 304 responses
+    def __init__(self, snapshot_id):
+        self.current_snapshot = snapshot_id
+        self.table_snapshots = {}
+
+    def table_snapshot_id(self, table_name):
+        return self.table_snapshots.get(table_name, self.current_snapshot)
+
+
+@pytest.fixture
+def lake(monkeypatch):
+    lake = SnapshotLake(1)
+    monkeypatch.setattr(fetch_data, "ducklake", lake)
+    monkeypatch.setattr(fetch_data, "report_cache", ReportCache(max_bytes=1024, max_entry_bytes=256))
+    return lake
+
+
+def test_lru_evicts_least_recently_used_under_byte_budget():
+    cache = ReportCache(max_bytes=30, max_entry_bytes=30)
+    cache.put("a", "GOLD.t", 1, b"x" * 10, None)
+    cache.put("b", "GOLD.t", 1, b"x" * 10, "next-b")
+    cache.put("c", "GOLD.t", 1, b"x" * 10, None)
+    # reading "a" makes "b" the least recently used entry
+    assert cache.get("a", "GOLD.t", 1) == (b"x" * 10, None)
+    cache.put("d", "GOLD.t", 1, b"x" * 5, None)
+
+    assert list(cache.entries) == ["c", "a", "d"]
+    assert cache.size_bytes == 25
+    assert cache.get("b", "GOLD.t", 1) is None
+
+
+def test_replacing_an_entry_keeps_the_byte_count_exact():
+    cache = ReportCache(max_bytes=30, max_entry_bytes=30)
+    cache.put("a", "GOLD.t", 1, b"x" * 20, None)
+    cache.put("a", "GOLD.t", 1, b"x" * 5, "next")
+    assert cache.size_bytes == 5
+    assert cache.get("a", "GOLD.t", 1) == (b"x" * 5, "next")
+
+
+def test_entries_over_the_per_entry_limit_are_not_cached():
+    cache = ReportCache(max_bytes=100, max_entry_bytes=10)
+    cache.put("small", "GOLD.t", 1, b"x" * 10, None)
+    cache.put("large", "GOLD.t", 1, b"x" * 11, None)
+    assert list(cache.entries) == ["small"]
+    assert cache.size_bytes == 10
+
+
+def test_cache_stream_stops_collecting_past_the_entry_limit(lake):
+    chunks = ["a" * 200, "b" * 100]
+    assert b"".join(cache_stream(iter(chunks), "big", "GOLD.t", 1, None)) == b"a" * 200 + b"b" * 100
+    assert fetch_data.report_cache.get("big", "GOLD.t", 1) is None
+
+    assert b"".join(cache_stream(iter(["ok"]), "small", "GOLD.t", 1, "next")) == b"ok"
+    assert fetch_data.report_cache.get("small", "GOLD.t", 1) == (b"ok", "next")
+
+
+def test_snapshot_change_drops_only_that_tables_entries():
+    cache = ReportCache(max_bytes=100, max_entry_bytes=100)
+    cache.put("a", "GOLD.t", 1, b"x" * 10, None)
+    cache.put("b", "GOLD.t", 1, b"x" * 10, None)
+    cache.put("c", "GOLD.other", 1, b"x" * 5, None)
+    assert cache.get("a", "GOLD.t", 2) is None
+    assert list(cache.entries) == ["c"]
+    assert cache.size_bytes == 5
+    assert cache.snapshot_ids == {"GOLD.t": 2, "GOLD.other": 1}
+    assert cache.get("c", "GOLD.other", 1) == (b"x" * 5, None)
+
+
+def test_matching_etag_returns_304_without_querying(lake):
+    calls = []
+
+    def compute(report_id, **params):
+        calls.append(report_id)
+        return {"row_count": 3}
+
+    first = serve_cached_json("summary", 0, {"min_score": 90}, compute)
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "miss"
+    etag = first.headers["ETag"]
+
+    not_modified = serve_cached_json("summary", 0, {"min_score": 90}, compute, if_none_match=f'"other", {etag}')
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+
+    hit = serve_cached_json("summary", 0, {"min_score": 90}, compute)
+    assert hit.headers["X-Cache"] == "hit"
+    assert hit.body == first.body
+    assert calls == [0]
+
+
+def test_new_snapshot_changes_the_etag(lake):
+    compute = lambda report_id, **params: {"row_count": 3}
+    etag = serve_cached_json("summary", 0, {}, compute).headers["ETag"]
+    lake.current_snapshot = 2
+    response = serve_cached_json("summary", 0, {}, compute, if_none_match=etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.headers["X-Cache"] == "miss"
+
+
+def test_commit_to_another_table_keeps_the_etag_and_cache(lake):
+    compute = lambda report_id, **params: {"row_count": 3}
+    etag = serve_cached_json("summary", 0, {}, compute).headers["ETag"]
+    # e.g. a bronze sync or another gold model's build
+    lake.table_snapshots["GOLD.nyc_matched_job_posting_duration_SOC"] = 9
+    assert serve_cached_json("summary", 0, {}, compute, if_none_match=etag).status_code == 304
+    assert serve_cached_json("summary", 0, {}, compute).headers["X-Cache"] == "hit"
+
+    lake.table_snapshots["GOLD.nyc_salary_matches"] = 9
+    assert serve_cached_json("summary", 0, {}, compute, if_none_match=etag).status_code == 200
+
+
+def test_report_pages_answer_304_and_cache_hits_before_opening_a_cursor(lake, monkeypatch):
+    def fail_open(*args, **kwargs):
+        raise AssertionError("a cached or unchanged page must not query DuckLake")
+
+    monkeypatch.setattr(fetch_data, "open_dataset_page", fail_open)
+    cache_key = json.dumps(["0", "json", None, 10, []], default=str)
+    etag = fetch_data.report_etag(1, cache_key)
+    fetch_data.report_cache.put(cache_key, "GOLD.nyc_salary_matches", 1, b'{"data":[],"next_cursor":null}', None)
+
+    assert serve_report(0, "json", if_none_match=etag, page_size=10).status_code == 304
+    hit = serve_report(0, "json", page_size=10)
+    assert hit.headers["X-Cache"] == "hit"
+    assert hit.body == b'{"data":[],"next_cursor":null}'
@@ -0,0 +1,121 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from utils import apply_limit_to_matches, build_salary_interval_index, salary_ranges_overlap
+from fuzzy_match_salary import match_all_rows, match_unique_titles
+
+
+class CollectingWriter:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame)
+
+
+def test_salary_interval_index_slices_sorted_salaries():
+    salaries = np.array([10.0, 20.0, 20.0, 30.0, np.nan, np.nan])
+    lower, upper = build_salary_interval_index(
+        salaries,
+        np.array([15.0, 20.0, 0.0, 31.0]),
+        np.array([25.0, 30.0, 100.0, 40.0]),
+    )
+    assert lower.tolist() == [1, 1, 0, 4]
+    assert upper.tolist() == [3, 4, 4, 4]
+
+
+def test_salary_interval_index_empties_missing_and_inverted_ranges():
+    salaries = np.array([10.0, 20.0, 30.0])
+    lower, upper = build_salary_interval_index(
+        salaries,
+        np.array([np.nan, 10.0, 30.0]),
+        np.array([30.0, np.nan, 10.0]),
+    )
+    assert (upper - lower).tolist() == [0, 0, 0]
+
+
+def test_salary_ranges_overlap_handles_nan_and_inverted_ranges():
+    overlap = salary_ranges_overlap(
+        np.array([10.0, 10.0, np.nan, 10.0, 30.0, 20.0]),
+        np.array([20.0, 20.0, 20.0, 20.0, 10.0, 20.0]),
+        np.array([20.0, 21.0, 10.0, 15.0, 15.0, 20.0]),
+        np.array([30.0, 30.0, 20.0, np.nan, 20.0, 20.0]),
+    )
+    assert overlap.tolist() == [True, False, False, False, False, True]
+
+
+def test_apply_limit_keeps_top_scores_per_group():
+    groups, others, scores = apply_limit_to_matches(
+        np.array([1, 0, 1, 0, 1]),
+        np.array([10, 11, 12, 13, 14]),
+        np.array([50.0, 90.0, 70.0, 80.0, 60.0]),
+        2,
+    )
+    assert groups.tolist() == [0, 0, 1, 1]
+    assert others.tolist() == [11, 13, 12, 14]
+    assert scores.tolist() == [90.0, 80.0, 70.0, 60.0]
+
+
+def test_apply_limit_breaks_ties_by_original_order():
+    groups, others, scores = apply_limit_to_matches(
+        np.array([0, 0, 0, 0]),
+        np.array([7, 5, 9, 3]),
+        np.array([80.0, 90.0, 80.0, 80.0]),
+        2,
+    )
+    assert groups.tolist() == [0, 0]
+    assert others.tolist() == [5, 7]
+    assert scores.tolist() == [90.0, 80.0]
+
+
+@pytest.mark.parametrize("limit", [None, 1, 2])
+def test_unique_title_path_matches_row_level_path(limit):
+    jobs_df = pl.DataFrame({
+        "business_title": ["Data Analyst", "data analyst!", "Civil Engineer", "Civil Engineer", "Clerk", None],
+        "salary_range_from": [50_000.0, 70_000.0, 80_000.0, None, 30_000.0, 10_000.0],
+        "salary_range_to": [90_000.0, 120_000.0, 60_000.0, 90_000.0, 45_000.0, 99_000.0],
+    })
+    payroll_df = pl.DataFrame({
+        "title_description": ["DATA ANALYST", "Data Analyst II", "Civil Engineer", "clerk", "Clerk", "Data Analyst"],
+        "base_salary": [60_000.0, 100_000.0, 85_000.0, 40_000.0, None, 75_000.0],
+        "fiscal_year": [2024, 2024, 2025, 2025, 2024, 2025],
+    })
+    columns = ["business_title", "salary_range_from", "salary_range_to", "title_description", "base_salary", "fiscal_year", "score"]
+
+    row_writer = CollectingWriter()
+    match_all_rows(jobs_df, payroll_df, row_writer, 85, 85, limit, 2, True)
+    unique_writer = CollectingWriter()
+    match_unique_titles(jobs_df, payroll_df, unique_writer, 85, 85, limit, 2, 3, True)
+
+    def collected(writer):
+        frame = pl.concat([frame.select(columns) for frame in writer.frames])
+        return frame.with_columns(pl.col("score").cast(pl.Int64)).sort(columns, nulls_last=True)
+
+    row_matches = collected(row_writer)
+    assert row_matches.height > 0
+    assert row_matches.equals(collected(unique_writer))
+
+
+def test_limit_is_per_job_across_payroll_chunks():
+    # four equally scored payroll rows split over two chunks; both paths keep the same single best row
+    jobs_df = pl.DataFrame({
+        "business_title": ["Clerk"],
+        "salary_range_from": [10_000.0],
+        "salary_range_to": [90_000.0],
+    })
+    payroll_df = pl.DataFrame({
+        "title_description": ["Clerk"] * 4,
+        "base_salary": [40_000.0, 20_000.0, 30_000.0, 50_000.0],
+        "fiscal_year": [2022, 2023, 2024, 2025],
+    })
+
+    row_writer = CollectingWriter()
+    match_all_rows(jobs_df, payroll_df, row_writer, 85, 85, 1, 2, True)
+    unique_writer = CollectingWriter()
+    match_unique_titles(jobs_df, payroll_df, unique_writer, 85, 85, 1, 2, 3, True)
+
+    for writer in (row_writer, unique_writer):
+        matches = pl.concat(writer.frames)
+        # ties go to the earliest payroll row
+        assert matches.select("base_salary", "fiscal_year").rows() == [(40_000.0, 2022)]